@@ -0,0 +1,777 @@
+# ===============
+# benchmarks.py
+# ===============
+
+# Benchmarks for the hot paths in ducks.py and examples.py
+#
+#   python benchmarks.py                      the timing suite: warmup, repeats, percentiles
+#   python benchmarks.py --json results.json  ... and write the results as JSON
+#   python benchmarks.py --save-baseline      ... and store them as the baseline to compare later runs with
+#   python benchmarks.py --reports [birds]    the longer reports (memory, scaling, sinks, ...) below
+#
+# Every run of the suite is compared with the baseline file (benchmarks_baseline.json by default)
+# if there is one, and cases that got slower than --tolerance are marked as regressions.
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from contextlib import redirect_stdout
+
+import ducks
+import division
+import exceptionprofiler
+import factorials
+import intreader
+import roster
+
+
+def measure_memory(build):
+    """ Returns (result, bytes allocated) for calling build() """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+# ==================================
+# Columnar flock memory
+# ==================================
+
+def build_object_flock(n):
+    flock = ducks.Flock()
+    for _ in range(n):
+        flock.add_duck(ducks.Duck())
+    return flock
+
+
+def build_columnar_flock(n):
+    flock = ducks.ColumnarFlock()
+    duck_code = ducks.SPECIES_CODES[ducks.Duck]
+    for _ in range(n):
+        flock.add_bird(duck_code)
+    return flock
+
+
+def bench_columnar_memory(n):
+    _, object_bytes = measure_memory(lambda: build_object_flock(n))
+    _, columnar_bytes = measure_memory(lambda: build_columnar_flock(n))
+    print("Flock memory for {} ducks".format(n))
+    print("  list of objects: {:>14,} bytes ({:.1f} per bird)".format(object_bytes, object_bytes / n))
+    print("  columnar:        {:>14,} bytes ({:.1f} per bird)".format(columnar_bytes, columnar_bytes / n))
+
+
+# ==================================
+# Batch migrate
+# ==================================
+
+def fly_one_by_one(flock):
+    # The Flock.migrate loop without the CHANGE_7 test exception
+    for duck in flock.flock:
+        try:
+            duck.fly()
+        except AttributeError:
+            pass
+
+
+def bench_batch_migrate(n):
+    flock = build_object_flock(n)
+    columnar = build_columnar_flock(n)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        fly_one_by_one(flock)
+        per_bird = time.perf_counter() - start
+        start = time.perf_counter()
+        flock.batch_migrate()
+        batch = time.perf_counter() - start
+        start = time.perf_counter()
+        columnar.batch_migrate()
+        columnar_batch = time.perf_counter() - start
+    print("Migrate {} ducks".format(n))
+    print("  fly() per bird:         {:.3f}s".format(per_bird))
+    print("  Flock.batch_migrate:    {:.3f}s".format(batch))
+    print("  Columnar.batch_migrate: {:.3f}s".format(columnar_batch))
+
+
+# ==================================
+# Output sinks
+# ==================================
+
+class CountingStream(object):
+    # Stands in for stdout, throws the text away but counts the write calls
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+def bench_sinks(n):
+    flock = build_object_flock(n)
+    print("Migrate {} ducks through each sink".format(n))
+    for name, make_sink in (('print', ducks.StdoutSink), ('buffered', ducks.BufferedSink),
+                            ('counting', ducks.CountingSink), ('null', ducks.NullSink)):
+        stream = CountingStream()
+        with redirect_stdout(stream):
+            start = time.perf_counter()
+            with ducks.using_sink(make_sink()):
+                fly_one_by_one(flock)
+            elapsed = time.perf_counter() - start
+        print("  {:<9} {:.3f}s {:>10,} writes".format(name, elapsed, stream.writes))
+
+
+# ==================================
+# add_duck
+# ==================================
+
+class BaselineFlock(object):
+    # The Flock from before the index and add_ducks, with the CHANGE_5/CHANGE_6 add_duck
+
+    def __init__(self):
+        self.flock = []
+
+    def add_duck(self, duck):
+        fly_method = getattr(duck, 'fly', None)
+        if callable(fly_method):
+            self.flock.append(duck)
+        else:
+            raise TypeError("Cannot add duck, are you sure its not a "+str(type(duck).__name__))
+
+
+def bench_add_duck(n):
+    for species in (ducks.Duck, ducks.Penguin):
+        birds = [species() for _ in range(n)]
+        print("add_duck {} {}s".format(n, species.__name__))
+        for name, flock_class in (('baseline Flock.add_duck', BaselineFlock), ('Flock.add_duck', ducks.Flock)):
+            flock = flock_class()
+            start = time.perf_counter()
+            for duck in birds:
+                flock.add_duck(duck)
+            print("  {:<24} {:.3f}s".format(name, time.perf_counter() - start))
+        flock = ducks.Flock()
+        start = time.perf_counter()
+        flock.add_ducks(birds)
+        print("  {:<24} {:.3f}s".format('Flock.add_ducks', time.perf_counter() - start))
+
+
+# ==================================
+# Parallel migrate scaling
+# ==================================
+
+def bench_parallel_migrate(n):
+    flock = build_object_flock(n)
+    print("parallel_migrate {} ducks".format(n))
+    with ducks.using_sink(ducks.NullSink()):
+        for use_processes in (True, False):
+            for workers in range(1, (os.cpu_count() or 1) + 1):
+                start = time.perf_counter()
+                flock.parallel_migrate(workers, use_processes)
+                elapsed = time.perf_counter() - start
+                print("  {:<9} {:>3} workers: {:.3f}s".format(
+                    'processes' if use_processes else 'threads', workers, elapsed))
+
+
+# ==================================
+# Async migrate
+# ==================================
+
+class TelemetryDuck(ducks.Duck):
+    # A duck whose fly waits 1ms on (pretend) network I/O
+
+    async def fly(self):
+        await asyncio.sleep(0.001)
+        super().fly()
+
+
+def bench_amigrate(n):
+    flock = ducks.Flock()
+    flock.add_ducks(TelemetryDuck() for _ in range(n))
+    print("amigrate {} telemetry ducks".format(n))
+    with ducks.using_sink(ducks.NullSink()):
+        for limit in (1, 10, 100, 1000):
+            start = time.perf_counter()
+            asyncio.run(flock.amigrate(limit))
+            print("  limit {:>5}: {:.3f}s".format(limit, time.perf_counter() - start))
+
+
+# ==================================
+# Exceptions vs partitioning
+# ==================================
+
+class Grounded(object):
+    # A bird without a fly method, like the Penguin before CHANGE_7
+
+    def walk(self):
+        ducks.say("Waddle, waddle, I waddle too")
+
+
+def bench_partitioned_migrate(n):
+    print("Migrate {} birds, exception per non-flyer vs partition".format(n))
+    with ducks.using_sink(ducks.NullSink()):
+        for percent in (0, 10, 50, 90):
+            flock = ducks.Flock()
+            grounded = n * percent // 100
+            flock.flock.extend(ducks.Duck() for _ in range(n - grounded))
+            flock.flock.extend(Grounded() for _ in range(grounded))  # add_duck would refuse these
+            start = time.perf_counter()
+            ducks.migrate_shard(flock.flock)  # the migrate loop: try fly(), catch and record the AttributeError
+            per_exception = time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                flock.migrate_partitioned()
+            except ducks.MigrationFailed:
+                pass
+            partitioned = time.perf_counter() - start
+            print("  {:>3}% non-flyers: exceptions {:.3f}s  partitioned {:.3f}s".format(
+                percent, per_exception, partitioned))
+
+
+# ==================================
+# Bytes per bird
+# ==================================
+
+def bench_bytes_per_bird(sizes):
+    species = (ducks.Duck, ducks.Mallard, ducks.Penguin,
+               ducks.CompactDuck, ducks.CompactMallard, ducks.CompactPenguin)
+    for n in sizes:
+        print("Bytes per bird, {} birds".format(n))
+        for bird in species:
+            birds, allocated = measure_memory(lambda: [bird() for _ in range(n)])
+            del birds
+            print("  {:<15} {:>7.1f}".format(bird.__name__, allocated / n))
+
+
+# ==================================
+# Shared wings
+# ==================================
+
+def bench_shared_wings(n):
+    # Half Ducks, half Mallards, once with a Wing per bird (WingTable(0)) and once with the shared wings
+    print("Building {} Ducks and Mallards".format(n))
+    kinds = (ducks.Duck, ducks.Mallard)
+    table = ducks.wing_table
+    try:
+        for name, wings in (('own wing', ducks.WingTable(0)), ('shared wing', ducks.WingTable())):
+            ducks.wing_table = wings
+            birds, allocated = measure_memory(lambda: [kinds[i & 1]() for i in range(n)])
+            del birds
+            elapsed = time_case(lambda: [kinds[i & 1]() for i in range(n)], 0, 3)['min']
+            print("  {:<12} {:>13,} bytes ({:5.1f} per bird)  {:.3f}s".format(name, allocated, allocated / n, elapsed))
+    finally:
+        ducks.wing_table = table
+
+
+# ==================================
+# Factorial engine
+# ==================================
+
+def bench_factorial(largest):
+    print("factorial(n) vs math.factorial(n)")
+    n = 1000
+    while n <= largest:
+        start = time.perf_counter()
+        factorials.calculate(n)
+        ours = time.perf_counter() - start
+        start = time.perf_counter()
+        math.factorial(n)
+        builtin = time.perf_counter() - start
+        print("  n = {:>9,}: factorials {:.4f}s  math {:.4f}s".format(n, ours, builtin))
+        n *= 10
+
+
+def bench_factorial_many(queries, largest=5000):
+    values = [random.randrange(largest + 1) for _ in range(queries)]
+    start = time.perf_counter()
+    for n in values:
+        math.factorial(n)
+    one_by_one = time.perf_counter() - start
+    start = time.perf_counter()
+    factorials.factorial_many(values)
+    batch = time.perf_counter() - start
+    print("{:,} factorial queries, n up to {:,}".format(queries, largest))
+    print("  math.factorial each: {:.3f}s ({:,.0f} queries/s)".format(one_by_one, queries / one_by_one))
+    print("  factorial_many:      {:.3f}s ({:,.0f} queries/s)".format(batch, queries / batch))
+
+
+def bench_factorial_digits(largest):
+    if hasattr(sys, 'set_int_max_str_digits'):
+        sys.set_int_max_str_digits(0)  # let str() convert numbers of any size so we can compare
+    print("Decimal digits of n!: str() vs LazyFactorial.write_digits()")
+    n = 1000
+    while n <= largest:
+        lazy = factorials.lazy_factorial(n)
+        value = lazy.value
+        start = time.perf_counter()
+        str(value)
+        plain = time.perf_counter() - start
+        with open(os.devnull, 'w') as devnull:
+            start = time.perf_counter()
+            lazy.write_digits(devnull)
+            chunked = time.perf_counter() - start
+        start = time.perf_counter()
+        lazy.digit_count(), lazy.leading_digits(), lazy.trailing_zeros()
+        summary = time.perf_counter() - start
+        print("  n = {:>9,}: str {:.3f}s  write_digits {:.3f}s  summaries {:.4f}s".format(n, plain, chunked, summary))
+        n *= 10
+
+
+def bench_parallel_factorial(n):
+    print("parallel_factorial({:,})".format(n))
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        start = time.perf_counter()
+        factorials.parallel_factorial(n, workers)
+        print("  {:>3} workers: {:.3f}s".format(workers, time.perf_counter() - start))
+
+
+def bench_factorial_store(n):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        value = factorials.calculate(n)
+        calculated = time.perf_counter() - start
+        with factorials.FactorialStore(directory) as store:
+            store.put(n, value)
+        start = time.perf_counter()
+        with factorials.FactorialStore(directory) as store:  # a fresh store, like the next run of a program
+            store.get(n)
+        loaded = time.perf_counter() - start
+    print("factorial({:,}): calculate {:.4f}s  load from FactorialStore {:.4f}s".format(n, calculated, loaded))
+
+
+# ==================================
+# Reading numbers
+# ==================================
+
+def getint_loop(count):
+    # The examples.py getint: one input() per number, ValueError means try the next line
+    numbers = []
+    while len(numbers) < count:
+        try:
+            numbers.append(int(input()))
+        except ValueError:
+            pass
+        except EOFError:
+            break
+    return numbers
+
+
+def bench_read_ints(n):
+    lines = [str(random.randrange(-10 ** 9, 10 ** 9)) if i % 1000 else "oops" for i in range(n)]
+    text = '\n'.join(lines) + '\n'
+    stdin = sys.stdin
+    try:
+        sys.stdin = io.StringIO(text)
+        start = time.perf_counter()
+        getint_loop(n)
+        one_by_one = time.perf_counter() - start
+    finally:
+        sys.stdin = stdin
+    start = time.perf_counter()
+    for _ in intreader.read_ints(io.StringIO(text), on_error=lambda token, line, column: None):
+        pass
+    streamed = time.perf_counter() - start
+    print("Reading {:,} numbers (1 in 1000 invalid)".format(n))
+    print("  input() per number: {:.3f}s".format(one_by_one))
+    print("  read_ints:          {:.3f}s".format(streamed))
+
+
+# ==================================
+# Dividing many pairs
+# ==================================
+
+def divide_loop(numerators, denominators, fill=float('nan')):
+    # The examples.py division with try/except, once per pair
+    quotients = []
+    for number1, number2 in zip(numerators, denominators):
+        try:
+            quotients.append(number1 / number2)
+        except ZeroDivisionError:
+            quotients.append(fill)
+    return quotients
+
+
+def bench_divide_all(n):
+    numerators = array('d', (random.random() * 100 for _ in range(n)))
+    denominators = array('d', (random.randrange(100) for _ in range(n)))  # about 1 in 100 is zero
+    start = time.perf_counter()
+    divide_loop(numerators, denominators)
+    looped = time.perf_counter() - start
+    print("Dividing {:,} pairs".format(n))
+    print("  try/except per pair: {:.3f}s".format(looped))
+    for policy in (division.FILL, division.SKIP):
+        start = time.perf_counter()
+        division.divide_all(numerators, denominators, policy)
+        print("  divide_all {:<9} {:.3f}s".format(policy + ':', time.perf_counter() - start))
+
+
+# ==================================
+# Exception profiler
+# ==================================
+
+def bench_exception_profiler(n):
+    flock = ducks.Flock()
+    flock.add_ducks(ducks.Duck() for _ in range(n))
+
+    def migrate():
+        try:
+            flock.migrate()
+        except ducks.MigrationFailed:
+            pass
+
+    profiler = exceptionprofiler.ExceptionProfiler(enabled=False)
+    profiled = profiler.profile(migrate)
+    print("Flock.migrate of {} ducks under the exception profiler".format(n))
+    with ducks.using_sink(ducks.NullSink()):
+        for label, call in (('plain', migrate), ('disabled', profiled)):
+            start = time.perf_counter()
+            call()
+            print("  {:<9} {:.3f}s".format(label, time.perf_counter() - start))
+        profiler.enabled = True
+        start = time.perf_counter()
+        profiled()
+        print("  {:<9} {:.3f}s".format('enabled', time.perf_counter() - start))
+    print(profiler.table())
+
+
+# ==================================
+# Flock queries
+# ==================================
+
+def query_flock(n):
+    flock = ducks.Flock()
+    kinds = (ducks.Duck, ducks.Mallard, ducks.Penguin)
+    flock.add_ducks(kinds[i % 3]() for i in range(n))
+    return flock
+
+
+def bench_flock_queries(sizes):
+    # The same three questions, answered by scanning the flock and from the index
+    print("Flock queries (scan vs index)")
+    for n in sizes:
+        flock = query_flock(n)
+        questions = [
+            ("count Mallards", lambda: sum(1 for duck in flock.flock if type(duck) is ducks.Mallard),
+             lambda: flock.count(ducks.Mallard)),
+            ("count flyers", lambda: sum(1 for duck in flock.flock if callable(getattr(duck, 'fly', None))),
+             lambda: flock.count(capability='fly')),
+            ("list flying Penguins", lambda: [duck for duck in flock.flock if type(duck) is ducks.Penguin
+                                              and callable(getattr(duck, 'fly', None))],
+             lambda: list(flock.birds(ducks.Penguin, 'fly'))),
+        ]
+        for name, scan, indexed in questions:
+            scan_time = time_case(scan, 1, 5)['median']
+            index_time = time_case(indexed, 1, 5)['median']
+            print("  {:>9} birds {:<22} scan {:.6f}s  index {:.6f}s".format(n, name, scan_time, index_time))
+
+
+# ==================================
+# Incremental migrate
+# ==================================
+
+def bench_incremental_migrate(n, rounds=10):
+    # Birds arrive in rounds and the flock migrates after every round
+    arrivals = [[ducks.Duck() for _ in range(n // rounds)] for _ in range(rounds)]
+    print("migrate after each of {} rounds of {} new ducks".format(rounds, n // rounds))
+    with ducks.using_sink(ducks.NullSink()):
+        for name in ('whole flock', 'incremental'):
+            flock = ducks.Flock()
+            start = time.perf_counter()
+            for birds in arrivals:
+                flock.add_ducks(birds)
+                if name == 'incremental':
+                    flock.migrate_incremental()
+                else:
+                    ducks.migrate_shard(flock.flock)
+            print("  {:<12} {:.3f}s".format(name, time.perf_counter() - start))
+
+
+# ==================================
+# Flock snapshots
+# ==================================
+
+def bench_snapshot(n):
+    flock = build_object_flock(n)
+    with tempfile.TemporaryDirectory() as directory:
+        pickled = os.path.join(directory, 'flock.pickle')
+        snapshot = os.path.join(directory, 'flock.snap')
+        start = time.perf_counter()
+        with open(pickled, 'wb') as pickle_file:
+            pickle.dump(flock, pickle_file, pickle.HIGHEST_PROTOCOL)
+        pickle_save = time.perf_counter() - start
+        start = time.perf_counter()
+        ducks.save_snapshot(flock, snapshot)
+        snapshot_save = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(pickled, 'rb') as pickle_file:
+            pickle.load(pickle_file)
+        pickle_load = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped = ducks.open_snapshot(snapshot)
+        snapshot_open = time.perf_counter() - start
+        with ducks.using_sink(ducks.NullSink()):
+            start = time.perf_counter()
+            mapped.batch_migrate()
+            snapshot_migrate = time.perf_counter() - start
+        mapped.close()
+        print("Saving and loading {} birds".format(n))
+        print("  pickle:   {:>11,} bytes  save {:.3f}s  load {:.3f}s".format(
+            os.path.getsize(pickled), pickle_save, pickle_load))
+        print("  snapshot: {:>11,} bytes  save {:.3f}s  open {:.6f}s  batch_migrate from the map {:.3f}s".format(
+            os.path.getsize(snapshot), snapshot_save, snapshot_open, snapshot_migrate))
+
+
+# ==================================
+# Roster loading
+# ==================================
+
+def write_roster(filename, n, kind):
+    # n rows of Ducks, Mallards and Penguins, with one malformed row in every hundred
+    names = ('Duck', 'Mallard', 'Penguin')
+    with open(filename, 'w') as roster_file:
+        for row in range(n):
+            species = 'Goose' if row % 100 == 99 else names[row % 3]
+            if kind == 'csv':
+                roster_file.write("{},{}\n".format(species, 1 + row % 7 / 4))
+            else:
+                roster_file.write('{{"species": "{}", "ratio": {}}}\n'.format(species, 1 + row % 7 / 4))
+
+
+def bench_roster(n):
+    print("load_roster {} rows".format(n))
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in ('csv', 'jsonl'):
+            filename = os.path.join(directory, 'roster.' + kind)
+            write_roster(filename, n, kind)
+            size = os.path.getsize(filename)
+            for flock in (ducks.Flock(), ducks.ColumnarFlock()):
+                start = time.perf_counter()
+                roster.load_roster(filename, flock, on_error=None)
+                elapsed = time.perf_counter() - start
+                print("  {:<5} into {:<13} {:>10,.0f} rows/s  {:6.1f} MB/s  ({:.0f}s per GB)".format(
+                    kind, type(flock).__name__, n / elapsed, size / elapsed / 1e6, elapsed * 1e9 / size))
+
+
+# ==================================
+# The suite
+# ==================================
+
+# Each case is set up once, then its function is run `warmup` times without timing and `repeats` times with timing.
+
+def percentile(ordered, fraction):
+    """ Nearest rank percentile of an already sorted list """
+    index = max(0, min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def time_case(function, warmup, repeats):
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {'repeats': repeats, 'min': times[0], 'median': percentile(times, 0.5),
+            'p90': percentile(times, 0.9), 'max': times[-1], 'mean': sum(times) / len(times)}
+
+
+def recursive_factorial(n):
+    """ The examples.py factorial """
+    if n <= 1:
+        return 1
+    else:
+        return n * recursive_factorial(n-1)
+
+
+def add_type_is(flock, duck):
+    # CHANGE_3 in ducks.py
+    if type(duck) is ducks.Duck:
+        flock.flock.append(duck)
+
+
+def add_isinstance(flock, duck):
+    # CHANGE_4 in ducks.py
+    if isinstance(duck, ducks.Duck):
+        flock.flock.append(duck)
+
+
+def mixed_flock(n, percent_grounded):
+    flock = ducks.Flock()
+    grounded = n * percent_grounded // 100
+    flock.flock.extend(ducks.Duck() for _ in range(n - grounded))
+    flock.flock.extend(Grounded() for _ in range(grounded))
+    random.Random(percent_grounded).shuffle(flock.flock)
+    return flock
+
+
+def ignore_failures(migrate):
+    def run():
+        try:
+            migrate()
+        except ducks.MigrationFailed:
+            pass
+    return run
+
+
+def fill_flock(add, birds, flock_class=ducks.Flock):
+    def run():
+        flock = flock_class()
+        for duck in birds:
+            add(flock, duck)
+    return run
+
+
+def read_with_getint(text, count):
+    def run():
+        stdin = sys.stdin
+        sys.stdin = io.StringIO(text)
+        try:
+            getint_loop(count)
+        finally:
+            sys.stdin = stdin
+    return run
+
+
+def suite_cases(n):
+    """ Yields (name, function) for every case in the suite, n is the number of birds """
+    for species in (ducks.Duck, ducks.Mallard, ducks.Penguin):
+        yield "construct {} x{}".format(species.__name__, n), lambda species=species: [species() for _ in range(n)]
+
+    birds = [ducks.Duck() for _ in range(n)]
+    yield "add_duck type is x{}".format(n), fill_flock(add_type_is, birds)
+    yield "add_duck isinstance x{}".format(n), fill_flock(add_isinstance, birds)
+    yield "add_duck baseline method x{}".format(n), fill_flock(BaselineFlock.add_duck, birds, BaselineFlock)
+    yield "add_duck Flock.add_duck x{}".format(n), fill_flock(ducks.Flock.add_duck, birds)
+    yield "add_ducks x{}".format(n), lambda: ducks.Flock().add_ducks(birds)
+
+    for percent in (0, 10, 90):
+        flock = mixed_flock(n, percent)
+        yield "migrate {}% non-flyers x{}".format(percent, n), ignore_failures(flock.migrate)
+        yield "migrate loop {}% non-flyers x{}".format(percent, n), lambda flock=flock: ducks.migrate_shard(flock.flock)
+        yield "migrate_partitioned {}% non-flyers x{}".format(percent, n), ignore_failures(flock.migrate_partitioned)
+
+    yield "factorial recursive 500", lambda: recursive_factorial(500)
+    for size in (500, 10000, 100000):
+        yield "factorial binary split {}".format(size), lambda size=size: factorials.calculate(size)
+        yield "factorial math {}".format(size), lambda size=size: math.factorial(size)
+    rng = random.Random(1)
+    values = [rng.randrange(2000) for _ in range(1000)]
+    yield "factorial_many 1000 queries", lambda: factorials.factorial_many(values)
+
+    lines = [str(number) if number % 100 else "oops" for number in range(1, n + 1)]
+    text = '\n'.join(lines) + '\n'
+    yield "getint input() x{}".format(n), read_with_getint(text, n)
+    yield "read_ints x{}".format(n), lambda: sum(1 for _ in intreader.read_ints(io.StringIO(text)))
+
+
+def run_suite(n, warmup, repeats):
+    results = {}
+    with ducks.using_sink(ducks.NullSink()):
+        for name, function in suite_cases(n):
+            results[name] = time_case(function, warmup, repeats)
+            stats = results[name]
+            print("{:<42} median {:>9.5f}s  p90 {:>9.5f}s  min {:>9.5f}s".format(
+                name, stats['median'], stats['p90'], stats['min']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Prints how each case compares to the baseline, returns the names of the cases that got slower """
+    # compare the fastest runs, they are the least disturbed by whatever else the machine is doing
+    regressions = []
+    print("Compared with the baseline (tolerance {:.0%})".format(tolerance))
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = stats['min'] / before['min'] if before['min'] else float('inf')
+        status = ''
+        if ratio > 1 + tolerance:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        print("  {:<42} {:>6.2f}x {}".format(name, ratio, status))
+    return regressions
+
+
+def reports(birds):
+    bench_columnar_memory(birds)
+    bench_batch_migrate(birds)
+    bench_sinks(birds)
+    bench_add_duck(birds)
+    bench_parallel_migrate(birds)
+    bench_amigrate(min(birds, 2000))
+    bench_partitioned_migrate(birds)
+    bench_bytes_per_bird((birds // 10, birds))
+    bench_factorial(birds)
+    bench_factorial_many(10000)
+    bench_factorial_digits(min(birds, 100000))
+    bench_parallel_factorial(birds)
+    bench_factorial_store(min(birds, 100000))
+    bench_read_ints(birds)
+    bench_divide_all(birds * 10)
+    bench_exception_profiler(min(birds, 100000))
+    bench_flock_queries((birds // 100, birds // 10, birds))
+    bench_incremental_migrate(birds)
+    bench_snapshot(birds)
+    bench_roster(birds)
+    bench_shared_wings(birds)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for ducks.py and examples.py")
+    parser.add_argument('--birds', type=int, default=10000, help="flock size for the suite (default 10000)")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help="write the results to FILE as JSON")
+    parser.add_argument('--baseline', metavar='FILE', default='benchmarks_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed slow down before a regression")
+    parser.add_argument('--reports', nargs='?', type=int, const=1000000, metavar='BIRDS',
+                        help="run the longer reports instead of the suite")
+    options = parser.parse_args(arguments)
+
+    if options.reports:
+        reports(options.reports)
+        return 0
+
+    random.seed(options.seed)
+    results = run_suite(options.birds, options.warmup, options.repeats)
+    document = {'python': platform.python_version(), 'platform': platform.platform(),
+                'birds': options.birds, 'warmup': options.warmup, 'results': results}
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump(document, output, indent=2)
+    regressions = []
+    if os.path.exists(options.baseline) and not options.save_baseline:
+        with open(options.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'], options.tolerance)
+    if options.save_baseline:
+        with open(options.baseline, 'w') as output:
+            json.dump(document, output, indent=2)
+        print("Saved the baseline to {}".format(options.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# ===============
+# division.py
+# ===============
+
+# examples.py divides number1 by number2 and catches ZeroDivisionError for that one pair.
+# divide_all divides whole sequences of numbers pair by pair, in one go, without a try/except per pair.
+# Zero divisors are handled by a policy:
+#   RAISE - raise ZeroDivisionError for the first zero divisor (and say where it is)
+#   SKIP  - leave those pairs out of the quotients
+#   FILL  - put a fill value (nan by default) in their place
+# It returns (quotients, zeros) where zeros[i] is 1 if denominators[i] was zero.
+# numpy is what makes divide_all fast: with numpy installed it does the whole division in one go and both results
+# are numpy arrays. Without numpy you still get the policies, but no speedup: the division is an ordinary python loop
+# (a list and an array('B') come back), a little slower than the bare try/except loop as it also records the zeros.
+
+from array import array
+
+from optional import numpy
+
+RAISE = 'raise'
+SKIP = 'skip'
+FILL = 'fill'
+
+
+def divide_all(numerators, denominators, policy=FILL, fill=float('nan')):
+    """ Returns (quotients, zeros) for numerators[i] / denominators[i] """
+    if len(numerators) != len(denominators):
+        raise ValueError("Need as many numerators as denominators, got {} and {}".format(
+            len(numerators), len(denominators)))
+    if policy not in (RAISE, SKIP, FILL):
+        raise ValueError("Unknown policy {!r}".format(policy))
+    if numpy is not None:
+        return divide_arrays(numpy.asarray(numerators, dtype=numpy.float64),
+                             numpy.asarray(denominators, dtype=numpy.float64), policy, fill)
+
+    # Without numpy: the examples.py try/except, once per pair, plus the zeros and the policy
+    zeros = array('B', bytes(len(denominators)))
+    quotients = []
+    append = quotients.append
+    for position, (numerator, denominator) in enumerate(zip(numerators, denominators)):
+        try:
+            append(numerator / denominator)
+        except ZeroDivisionError:
+            if policy == RAISE:
+                raise ZeroDivisionError("division by zero at position {}".format(position)) from None
+            zeros[position] = 1
+            if policy == FILL:
+                append(fill)
+    return quotients, zeros
+
+
+def divide_arrays(numerators, denominators, policy, fill):
+    zeros = denominators == 0
+    if policy == RAISE and zeros.any():
+        raise ZeroDivisionError("division by zero at position {}".format(int(zeros.argmax())))
+    quotients = numpy.full(numerators.shape, fill, dtype=numpy.float64)
+    numpy.divide(numerators, denominators, out=quotients, where=~zeros)
+    if policy == SKIP:
+        quotients = quotients[~zeros]
+    return quotients, zeros
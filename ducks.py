@@ -29,6 +29,170 @@
 
 # we will add another class called "Flock"  right after the "penguin" class
 
+import asyncio
+import inspect
+import mmap
+import os
+import struct
+import sys
+import weakref
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from heapq import merge
+from itertools import compress, filterfalse, islice, repeat
+
+from optional import numpy  # None without numpy, then batch_migrate classifies the ratios in a python loop
+
+
+# ============================
+# Output sinks
+# ============================
+
+# Every fly/walk/swim/quack below sends its message through say() instead of calling print() directly.
+# say() hands the message to the current sink, which is a StdoutSink (plain print) unless you pick another one:
+#   BufferedSink  - keeps the lines in memory and writes them all at once on flush()
+#   FileSink      - a BufferedSink that writes to a file
+#   NullSink      - throws the messages away
+#   CountingSink  - only counts how often each message was said
+# With a BufferedSink a migration of a million birds is one write instead of a million prints.
+
+
+class StdoutSink(object):
+
+    def write(self, message):
+        print(message)
+
+    def flush(self):
+        pass
+
+
+class NullSink(object):
+
+    def write(self, message):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BufferedSink(object):
+
+    def __init__(self, stream=None, limit=None):
+        self.stream = stream  # None means whatever sys.stdout is when we flush
+        self.limit = limit    # flush automatically after this many lines, None means only on flush()
+        self.lines = []
+
+    def write(self, message):
+        self.lines.append(message)
+        if self.limit is not None and len(self.lines) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write('\n'.join(self.lines) + '\n')  # one write for the whole buffer
+            self.lines = []
+
+
+class FileSink(BufferedSink):
+
+    def __init__(self, filename, limit=100000):
+        super().__init__(open(filename, 'w'), limit)
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+
+class CountingSink(object):
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def write(self, message):
+        self.counts[message] += 1
+
+    def flush(self):
+        pass
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+sink = StdoutSink()
+
+
+def say(message):
+    sink.write(message)
+
+
+def set_sink(new_sink):
+    """ Makes new_sink the current sink and returns the old one """
+    global sink
+    old_sink, sink = sink, new_sink
+    return old_sink
+
+
+@contextmanager
+def using_sink(new_sink):
+    # with using_sink(BufferedSink()): flock.migrate()  - flushes and puts the old sink back afterwards
+    old_sink = set_sink(new_sink)
+    try:
+        yield new_sink
+    finally:
+        new_sink.flush()
+        set_sink(old_sink)
+
+
+# ============================
+# Capability checks
+# ============================
+
+# A bird can fly (or walk, swim, quack) when getattr finds something callable under that name, on the bird itself
+# or on its class. That is the CHANGE_5 check, and it also sees a fly set in __init__ (the Penguin's self.fly = self.aviate)
+# or a fly that was switched off on one bird (duck.fly = None).
+# can_all does the same check for a whole list of birds, with map doing the loop instead of a python for loop.
+#
+# Most birds just do what their class does, so capabilities works that out once per class:
+#   capabilities.lookup(Duck) -> frozenset({'fly', 'walk', 'swim', 'quack'})
+# A bird only differs from its class when it has one of the names in its own __dict__ (Penguin's self.fly,
+# duck.fly = None). We don't read bird.__dict__ to find those: CPython keeps the attributes of a plain object
+# without a dict and only builds one when you ask for __dict__ (64 more bytes per bird), so the birds themselves
+# are checked with can_all. After changing a class (Duck.fly = ...) call capabilities.invalidate(Duck).
+
+CAPABILITIES = ('fly', 'walk', 'swim', 'quack')
+
+
+def can_all(birds, name):
+    """ A list with True or False for every bird, saying if it can do name """
+    return list(map(callable, map(getattr, birds, repeat(name), repeat(None))))
+
+
+class CapabilityCache(object):
+
+    def __init__(self, names=CAPABILITIES):
+        self.names = names
+        self.cache = {}  # class -> frozenset of the capabilities its birds get from the class
+
+    def lookup(self, cls):
+        found = self.cache.get(cls)
+        if found is None:
+            found = self.cache[cls] = frozenset(name for name in self.names if callable(getattr(cls, name, None)))
+        return found
+
+    def invalidate(self, cls=None):
+        # Forget cls and every cached subclass of it (they inherit its methods), or everything if cls is None
+        if cls is None:
+            self.cache.clear()
+        else:
+            for cached in [cached for cached in self.cache if cls in cached.__mro__]:
+                del self.cache[cached]
+
+
+capabilities = CapabilityCache()
+
 
 class Wing(object):
 
@@ -37,26 +201,72 @@ class Wing(object):
 
     def fly(self):
         if self.ratio > 1:
-            print("Weee, this is fun")
+            say("Weee, this is fun")
         elif self.ratio == 1:
-            print("This is hard work, but I'm flying")
+            say("This is hard work, but I'm flying")
         else:
-            print("I think I'll just walk")
+            say("I think I'll just walk")
+
+
+# ============================
+# Shared wings
+# ============================
+
+# Every Duck (and Mallard) used to build its own Wing(1.8), so a million ducks meant a million identical wings.
+# Wings are now handed out by wing_table, which keeps one Wing per ratio and gives the same one to every bird
+# that asks for that ratio (a flyweight). The table only holds weak references, so when no bird uses a ratio
+# any more its Wing is freed and the entry goes away. It holds at most maxsize ratios, birds asking for a ratio
+# past that just get their own Wing, so a flock with millions of different ratios can't make the table grow forever.
+# Because the wings are shared, don't change a bird's wing in place (duck._wing.ratio = 0.5 changes every duck
+# with that ratio), give it a new one instead: duck._wing = wing_table.get(0.5)
+# wing_table = WingTable(0) switches the sharing off.
+# The compact birds further down share their CompactWings the same way, through compact_wing_table.
+
+
+class WingTable(object):
+
+    def __init__(self, maxsize=1024, wing_class=None):
+        self.maxsize = maxsize
+        self.wing_class = wing_class or Wing
+        self.refs = {}  # ratio -> weak reference to the shared Wing
+
+    def __len__(self):
+        return len(self.refs)
+
+    def get(self, ratio):
+        """ Returns the shared Wing for ratio """
+        ref = self.refs.get(ratio)
+        if ref is not None:
+            wing = ref()
+            if wing is not None:
+                return wing
+        wing = self.wing_class(ratio)
+        if ref is not None or len(self.refs) < self.maxsize:
+            self.refs[ratio] = weakref.KeyedRef(wing, self.forget, ratio)  # a weak reference that knows its ratio
+        return wing
+
+    def forget(self, ref):
+        # Called by the weak reference when the last bird using that Wing is gone
+        if self.refs.get(ref.key) is ref:
+            del self.refs[ref.key]
+
+
+wing_table = WingTable()
 
 
 class Duck(object):
 
     def __init__(self):
-        self._wing = Wing(1.8)
+        self._wing = wing_table.get(1.8)  # shared with every other duck, see "Shared wings" above
 
     def walk(self):
-        print("Waddle, waddle, waddle")
+        say("Waddle, waddle, waddle")
 
     def swim(self):
-        print("Come on in, the water's lovely")
+        say("Come on in, the water's lovely")
 
     def quack(self):
-        print("Quack quack")
+        say("Quack quack")
 
     def fly(self):
         self._wing.fly()
@@ -108,16 +318,16 @@ class Penguin(object):
         self.fly = self.aviate  # Note we don't include () after aviate, so without (), we are just adding a reference to aviate method
 
     def walk(self):
-        print("Waddle, waddle, I waddle too")
+        say("Waddle, waddle, I waddle too")
 
     def swim(self):
-        print("Come on in, but it's a bit chilly this far South")
+        say("Come on in, but it's a bit chilly this far South")
 
     def quack(self):
-        print("Are you 'avin' a larf? I'm a penguin")
+        say("Are you 'avin' a larf? I'm a penguin")
 
     def aviate(self):           # CHANGE_7 - we add this aviate method
-        print("This new Penguin is now able to fly")
+        say("This new Penguin is now able to fly")
 
 
 
@@ -128,6 +338,275 @@ class Penguin(object):
 class Mallard(Duck):
     pass
 
+# ============================
+# Compact birds with __slots__
+# ============================
+
+# Every Wing, Duck, Penguin and Mallard above carries a __dict__ to hold its attributes,
+# and the flying Penguin even stores a bound method in self.fly.
+# The Compact classes declare their attributes in __slots__ instead, so there is no __dict__ per bird.
+# They borrow their methods from the classes above, so they say exactly the same things,
+# and CompactPenguin gets fly at class level (fly = aviate) instead of setting it in __init__.
+# They all have a callable fly, so Flock.add_duck accepts them just like the originals.
+
+
+class CompactWing(object):
+    __slots__ = ('ratio', '__weakref__')  # __weakref__ so compact_wing_table can share them
+
+    def __init__(self, ratio):
+        self.ratio = ratio
+
+    fly = Wing.fly
+
+
+compact_wing_table = WingTable(wing_class=CompactWing)
+
+
+class CompactDuck(object):
+    __slots__ = ('_wing',)
+
+    def __init__(self):
+        self._wing = compact_wing_table.get(1.8)  # shared, like the Duck's wing
+
+    walk = Duck.walk
+    swim = Duck.swim
+    quack = Duck.quack
+    fly = Duck.fly  # same function, so batch_migrate still classifies these by wing ratio
+
+
+class CompactMallard(CompactDuck):
+    __slots__ = ()
+
+
+class CompactPenguin(object):
+    __slots__ = ()
+
+    walk = Penguin.walk
+    swim = Penguin.swim
+    quack = Penguin.quack
+    aviate = Penguin.aviate
+    fly = Penguin.aviate  # CHANGE_7's self.fly = self.aviate, done once for the class
+
+
+# ============================
+# Reporting many bad birds at once
+# ============================
+
+# Flock.add_ducks (in the last Flock class below) does not stop at the first bird that cannot fly.
+# It collects every rejected bird and raises one RejectedDucks at the end.
+# RejectedDucks is a TypeError, like the one add_duck raises, so "except TypeError" still catches it.
+# Like an ExceptionGroup it has an "exceptions" list, with one TypeError per rejected bird.
+
+
+class RejectedDucks(TypeError):
+
+    def __init__(self, rejected):
+        self.rejected = rejected  # list of (position in the input, bird)
+        self.exceptions = [TypeError("Cannot add duck at position {}, are you sure its not a {}".format(
+            position, type(bird).__name__)) for position, bird in rejected]
+        names = Counter(type(bird).__name__ for _, bird in rejected)
+        super().__init__("Cannot add {} birds that cannot fly: {}".format(
+            len(rejected), ", ".join("{} {}".format(count, name) for name, count in sorted(names.items()))))
+
+
+# ============================
+# Collecting migration failures
+# ============================
+
+# migrate used to keep only the last AttributeError ("problem = e"). With 10000 birds that cannot fly
+# we paid for 10000 exceptions with tracebacks and still only learned about the last one.
+# A FailureCollector keeps a small tuple per failure instead of the exception itself:
+#   (bird index, species, error type, message)
+# It only keeps the first max_samples of those tuples, plus a count per (species, error type),
+# so its memory stays the same however many birds fail.
+# At the end of a migration it raises one MigrationFailed, which is an AttributeError like before.
+# Its message counts the failures by species and error type and repeats the first error's message.
+
+
+class MigrationFailed(AttributeError):
+
+    def __init__(self, failures):
+        self.failures = failures  # the FailureCollector
+        kinds = ", ".join("{} {} {}".format(count, species, error)
+                          for (species, error), count in sorted(failures.counts.items()))
+        message = "{} birds could not fly ({})".format(failures.total, kinds)
+        if failures.samples:
+            _, _, _, first = failures.samples[0]
+            message += ", first error: {}".format(first)  # e.g. "Testing exception handling in migrate"
+        super().__init__(message)
+
+
+class FailureCollector(object):
+
+    def __init__(self, max_samples=10):
+        self.max_samples = max_samples
+        self.samples = []        # (bird index, species, error type, message) for the first max_samples failures
+        self.counts = Counter()  # (species, error type) -> number of failures
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+    def record(self, index, bird, error):
+        self.add(index, type(bird).__name__, type(error).__name__, str(error))
+
+    def add(self, index, species, kind, message):
+        # Same as record, for when we know a bird will fail without making it raise an exception first
+        self.counts[species, kind] += 1
+        self.total += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append((index, species, kind, message))
+
+    def add_many(self, indexes, species, kind, message):
+        # add() for a whole group of birds that failed the same way
+        self.counts[species, kind] += len(indexes)
+        self.total += len(indexes)
+        self.samples.extend((index, species, kind, message) for index in indexes[:self.max_samples - len(self.samples)])
+
+    def merge(self, other):
+        # Adds the failures from another collector (e.g. from one shard of a parallel migrate)
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.samples.extend(other.samples[:self.max_samples - len(self.samples)])
+
+    def raise_if_failed(self):
+        if self.total:
+            raise MigrationFailed(self)
+
+
+# ============================
+# Flock indexes
+# ============================
+
+# "How many Mallards are there?" or "which birds can fly?" used to be a pass over the whole flock.
+# A FlockIndex answers them without looking at every bird. For each class it keeps:
+#   by_species[Mallard]            -> positions of the birds whose class is exactly Mallard, in an array('q')
+#   defaults[Mallard]              -> what the class can do, from capabilities (plus fly, every bird in a Flock can fly)
+#   exceptions[Penguin, 'swim']    -> positions of the Penguins that differ from their class for swim
+# Almost every bird does what its class does, so the exception arrays stay empty and the index costs one 8 byte
+# position per bird. Flock.add_duck adds a bird with one append, Flock.add_ducks with one extend per class.
+# The birds are checked for exceptions (with can_all, a whole class at a time) the first time a capability is asked
+# about, and after that only the birds added since. Counts are the length of the species array, minus the exceptions
+# when the class has the capability and just the exceptions when it hasn't.
+# Positions are added in order, so every array is sorted and they can be merged back into flock order.
+# The index only sees birds added through the Flock. If you change flock.flock directly, change a bird that was
+# already checked (duck.fly = None), or change a class after its birds were added (Duck.fly = ...), call flock.reindex().
+
+
+class FlockIndex(object):
+
+    def __init__(self, birds):
+        self.birds = birds      # the flock's list, birds are looked up in it when they are checked
+        self.by_species = {}    # class -> positions of the birds of exactly that class
+        self.defaults = {}      # class -> frozenset of the capabilities its birds have, unless they are an exception
+        self.exceptions = {}    # (class, capability) -> positions of the birds of that class that differ from it
+        self.checked = {}       # class -> how many of its positions have been checked for exceptions
+
+    def new_species(self, kind):
+        self.defaults[kind] = capabilities.lookup(kind) | {'fly'}
+        for name in CAPABILITIES:
+            self.exceptions[kind, name] = array('q')
+        self.checked[kind] = 0
+        positions = self.by_species[kind] = array('q')
+        return positions
+
+    def add(self, position, bird):
+        positions = self.by_species.get(type(bird))
+        if positions is None:
+            positions = self.new_species(type(bird))
+        positions.append(position)
+
+    def add_many(self, start, birds):
+        # Birds that go to positions start, start + 1, ...
+        end = start + len(birds)
+        kinds = list(map(type, birds))
+        distinct = set(kinds)
+        for kind in distinct:
+            positions = self.by_species.get(kind)
+            if positions is None:
+                positions = self.new_species(kind)
+            if len(distinct) == 1:
+                positions.extend(range(start, end))
+            else:
+                positions.extend(compress(range(start, end), [other is kind for other in kinds]))
+
+    def check(self, kind):
+        # Looks for exceptions among the birds of kind added since the last check
+        positions = self.by_species[kind]
+        if self.checked[kind] == len(positions):
+            return
+        new = positions[self.checked[kind]:]
+        birds = list(map(self.birds.__getitem__, new))
+        defaults = self.defaults[kind]
+        for name in CAPABILITIES:
+            flags = can_all(birds, name)
+            if name not in defaults:
+                self.exceptions[kind, name].extend(compress(new, flags))
+            elif False in flags:
+                self.exceptions[kind, name].extend(compress(new, [not flag for flag in flags]))
+        self.checked[kind] = len(positions)
+
+    def kinds(self, species):
+        if species is None:
+            return list(self.by_species)
+        return [species] if species in self.by_species else []
+
+    def count(self, species=None, capability=None):
+        total = 0
+        for kind in self.kinds(species):
+            positions = self.by_species[kind]
+            if capability is None:
+                total += len(positions)
+                continue
+            self.check(kind)
+            differ = len(self.exceptions.get((kind, capability), ()))
+            total += len(positions) - differ if capability in self.defaults[kind] else differ
+        return total
+
+    def positions(self, species=None, capability=None):
+        found = []
+        for kind in self.kinds(species):
+            positions = self.by_species[kind]
+            if capability is not None:
+                self.check(kind)
+                differ = self.exceptions.get((kind, capability), ())
+                if capability not in self.defaults[kind]:
+                    positions = differ
+                elif differ:
+                    found.append(filterfalse(set(differ).__contains__, positions))
+                    continue
+            if positions:
+                found.append(positions)
+        if len(found) == 1:
+            return iter(found[0])
+        return merge(*found)  # each one is sorted, so this gives the positions in flock order
+
+
+# ============================
+# Incremental migrate
+# ============================
+
+# Flock.migrate flies the whole flock every time it is called. When it is called again and again while birds
+# keep arriving, the same birds fly over and over. Flock.migrate_incremental only flies:
+#   - the birds added since the last call (everything past a high-water mark, flock.migrated)
+#   - the birds marked as changed with flock.touch(position), e.g. after giving one a new wing
+#   - the birds that failed last time, so they are tried again
+# Every call is an epoch. Its MigrationReport says how many birds flew and which ones failed, and the reports of
+# the last few epochs are kept in flock.reports. migrate_incremental(full=True) flies every bird again, which is
+# what you want after changing flock.flock directly (removing or reordering birds).
+
+
+class MigrationReport(object):
+
+    def __init__(self, epoch, max_samples=10):
+        self.epoch = epoch
+        self.flown = 0      # birds that flew without an AttributeError in this epoch
+        self.failures = FailureCollector(max_samples)  # the birds that did not, only from this epoch
+
+    def __repr__(self):
+        return "MigrationReport(epoch={}, flown={}, failed={})".format(self.epoch, self.flown, self.failures.total)
+
+
 # we create the Flock object here.
 
 # We will add a hint to the add_duck method of class Flock so that users can know what to add.
@@ -375,6 +854,8 @@ class Flock(object):
 
 # Now we will raise an exception inside the for loop under under def migrate below. CHANGE_7
 # When you run code under migration.py, you get error message "AttributeError: Testing exception handling in migrate"
+# (migrate now reports all the failures at once, as "MigrationFailed: 7 birds could not fly (...), first error: Testing
+# exception handling in migrate", and MigrationFailed is an AttributeError)
 # this comes after each duck flies (even the ones that fly) and when all the ducks have been processed, then we get the
 # exception and the stack trace (stack trace is where it shows you lines that are causing errors).
 
@@ -392,27 +873,546 @@ class Flock(object):
 
     def __init__(self):
         self.flock = []  # Creates empty list called flock.
+        self.index = FlockIndex(self.flock)  # positions of the birds by species and by capability, see FlockIndex
+        self.migrated = 0   # birds before this position have been through migrate_incremental
+        self.dirty = set()  # positions to fly again on the next migrate_incremental (touched or failed)
+        self.epoch = 0
+        self.reports = deque(maxlen=100)  # MigrationReport of the recent migrate_incremental calls
 
     def add_duck(self, duck: Duck) -> None:  # we annotate by adding :, then type of parameter (Duck), then return value (->) then type of parameter (None)
-        fly_method = getattr(duck, 'fly', None)  # CHANGE_5 - get attribute 'fly' from duck instance, otherwise return None if not there
-        if callable(fly_method):  # if fly_method is callable (is True), then add new duck to flock
+        if callable(getattr(duck, 'fly', None)):  # CHANGE_5 - is there a fly method, on the duck or its class
+            self.index.add(len(self.flock), duck)
             self.flock.append(duck)  # Adds new duck to the flock
         else:                        # CHANGE_6: This raises an exception and tells user he added Class Penguin instead of Duck
             raise TypeError("Cannot add duck, are you sure its not a "+str(type(duck).__name__))
 
-    def migrate(self):
-        problem = None  # first we initialize problem with None.
-        for duck in self.flock:
+    def add_ducks(self, birds, chunk_size=10000) -> None:
+        # Adds many birds at once. birds can be any iterable, including a generator, it is read chunk_size birds at a time.
+        # Birds that cannot fly don't stop the load: every bird that can fly is added, then all the
+        # rejected birds are reported together in one RejectedDucks exception.
+        rejected = []
+        position = 0
+        birds = iter(birds)
+        while True:
+            chunk = list(islice(birds, chunk_size))
+            if not chunk:
+                break
+            flying = can_all(chunk, 'fly')
+            if False in flying:
+                accepted = list(compress(chunk, flying))
+                rejected.extend((position + offset, duck) for offset, duck in enumerate(chunk) if not flying[offset])
+            else:
+                accepted = chunk
+            self.index.add_many(len(self.flock), accepted)
+            self.flock.extend(accepted)  # one extend per chunk instead of one append per bird
+            position += len(chunk)
+        if rejected:
+            raise RejectedDucks(rejected)
+
+    def reindex(self):
+        # Builds the index again from self.flock, after the list or the bird classes were changed directly
+        capabilities.invalidate()
+        self.index = FlockIndex(self.flock)
+        self.index.add_many(0, self.flock)
+
+    def count(self, species=None, capability=None):
+        # flock.count(Mallard), flock.count(capability='fly'), flock.count(Penguin, 'fly') - answered from the index
+        return self.index.count(species, capability)
+
+    def positions(self, species=None, capability=None):
+        # Iterator over the positions in self.flock of the matching birds, in flock order
+        return self.index.positions(species, capability)
+
+    def birds(self, species=None, capability=None):
+        # Iterator over the matching birds themselves, in flock order
+        flock = self.flock
+        return (flock[position] for position in self.index.positions(species, capability))
+
+    def migrate(self, max_samples=10):
+        failures = FailureCollector(max_samples)  # instead of keeping the last AttributeError, we keep a short record of each one
+        for index, duck in enumerate(self.flock):
             try:              # Check to see if ducks can fly
                 duck.fly()    # causes every duck in the flock to fly by calling their fly method.
                 raise AttributeError("Testing exception handling in migrate")  # CHANGE_7 - TODO remove this before release
             except AttributeError as e:  # attribute error is assigned to variable e
-                print("This duck cannot fly")  # Notifies you there is a duck that cannot fly, indicating its probably not a duck
-                problem = e  # Then the variable problem is assigned the AttributeError e
-        if problem:  # if problem exist, in this case it does because we assigned it e
-            raise problem   # Then we raise the problem in the main program. raise is opposite of pass.
+                say("This duck cannot fly")  # Notifies you there is a duck that cannot fly, indicating its probably not a duck
+                failures.record(index, duck, e)  # records index, species and error type, e itself (and its traceback) is dropped
+        failures.raise_if_failed()  # raises one MigrationFailed (an AttributeError) if any duck could not fly
+
+    def touch(self, *positions):
+        # Marks birds that were changed in place, so the next migrate_incremental flies them again
+        for position in positions:
+            if not 0 <= position < len(self.flock):
+                raise IndexError("No bird at position {}, the flock has {} birds".format(position, len(self.flock)))
+        self.dirty.update(positions)
+
+    def migrate_incremental(self, full=False, max_samples=10):
+        # Flies only the birds that are new, touched or failed last time (all of them with full=True)
+        # and returns this epoch's MigrationReport. Raises MigrationFailed if any of them could not fly.
+        flock = self.flock
+        end = len(flock)
+        if full:
+            pending = range(end)
+        else:
+            pending = sorted(self.dirty.union(range(self.migrated, end)))  # a new bird may be touched too
+        self.epoch += 1
+        report = MigrationReport(self.epoch, max_samples)
+        failed = set()
+        done = 0
+        try:
+            for position in pending:
+                duck = flock[position]
+                try:
+                    duck.fly()
+                    report.flown += 1
+                except AttributeError as e:
+                    say("This duck cannot fly")
+                    report.failures.record(position, duck, e)
+                    failed.add(position)
+                done += 1
+        finally:
+            # Birds we did not get to, because something other than an AttributeError stopped us, stay pending
+            if full:
+                self.dirty.clear()
+            else:
+                self.dirty.difference_update(pending[:done])
+            self.dirty.update(pending[done:])
+            self.dirty.update(failed)
+            self.migrated = end
+            self.reports.append(report)
+        report.failures.raise_if_failed()
+        return report
+
+    def partition(self):
+        # Sorts the flock into (flyers, grounded), two lists of indexes, without calling any fly method.
+        # can_all checks the whole flock with map, without a python level loop.
+        flock = self.flock
+        flying = can_all(flock, 'fly')
+        flyers = list(compress(range(len(flock)), flying))
+        if len(flyers) == len(flock):
+            return flyers, []
+        return flyers, [index for index, can_fly in enumerate(flying) if not can_fly]
+
+    def migrate_partitioned(self, max_samples=10):
+        # Like migrate, but birds without a fly method are found up front by partition(), so they are
+        # reported without raising and catching an AttributeError for each one.
+        # The try is still there for flyers whose fly raises AttributeError itself (it costs nothing when nothing is raised).
+        flock = self.flock
+        failures = FailureCollector(max_samples)
+        flyers, grounded = self.partition()
+        for index in flyers:
+            duck = flock[index]
+            try:
+                duck.fly()
+            except AttributeError as e:
+                say("This duck cannot fly")
+                failures.record(index, duck, e)
+        by_species = {}
+        for index in grounded:
+            by_species.setdefault(type(flock[index]).__name__, []).append(index)
+        for species, indexes in by_species.items():
+            for _ in indexes:
+                say("This duck cannot fly")
+            failures.add_many(indexes, species, 'AttributeError', "'{}' object has no attribute 'fly'".format(species))
+        failures.raise_if_failed()
+
+    def batch_migrate(self):
+        # Plain Ducks (and subclasses that keep Duck.fly) only need their wing ratio, so we collect the ratios
+        # and classify them all in one pass. Birds with their own fly (like the Penguin whose fly is aviate)
+        # still fly one at a time.
+        # The indexes in the returned BatchMigration are positions in self.flock
+
+        # A bird flies like a duck when its bound fly is Duck.fly, this also catches a fly set on the instance
+        flock = self.flock
+        duck_fly = Duck.fly
+        positions = [index for index, duck in enumerate(flock)
+                     if getattr(getattr(duck, 'fly', None), '__func__', None) is duck_fly]
+        if len(positions) == len(flock):
+            custom = []
+            ratios = array('d', [duck._wing.ratio for duck in flock])
+        else:
+            custom = sorted(set(range(len(flock))).difference(positions))
+            ratios = array('d', [flock[index]._wing.ratio for index in positions])
+        result = classify_ratios(ratios, positions)
+        result.fly_each(flock, custom)
+        result.failures.raise_if_failed()
+        return result
+
+    def parallel_migrate(self, workers=None, use_processes=True, max_samples=10):
+        # Splits the flock into one shard per worker and flies the shards at the same time.
+        # Like migrate, an AttributeError does not stop the other birds, and the failures are raised together at the end.
+        # Returns how many birds flew.
+        workers = workers or os.cpu_count() or 1
+        shards, starts = split_into_shards(self.flock, workers)
+        if len(shards) <= 1 or not use_processes:
+            if len(shards) <= 1:
+                results = [migrate_shard(shard, start, max_samples) for shard, start in zip(shards, starts)]
+            else:
+                with ThreadPoolExecutor(max_workers=len(shards)) as executor:  # threads all say() to our sink
+                    results = list(executor.map(migrate_shard, shards, starts, [max_samples] * len(shards)))
+            results = [(shard_flown, shard_failures, []) for shard_flown, shard_failures in results]
+        else:
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                # map keeps the shards in order, each worker sends back what its birds said
+                results = list(executor.map(migrate_shard_in_worker, shards, starts, [max_samples] * len(shards)))
+        flown = 0
+        failures = FailureCollector(max_samples)
+        write = sink.write
+        for shard_flown, shard_failures, messages in results:
+            flown += shard_flown
+            failures.merge(shard_failures)  # shards are merged in flock order, so the samples are too
+            for message in messages:
+                write(message)  # said again in this process, through our sink
+        failures.raise_if_failed()
+        return flown
+
+    # Some fly methods talk to the network (telemetry) and spend most of their time waiting.
+    # amigrate lets those birds wait at the same time:  asyncio.run(flock.amigrate(limit=50))
+    async def amigrate(self, limit=100, max_samples=10):
+        # Like migrate, but a bird whose fly is a coroutine (async def fly) is awaited, and up to limit of them
+        # are in flight at the same time. A plain fly (Duck, Wing, Penguin) is just called.
+        # Failures are collected and raised together at the end, same as migrate.
+        birds = enumerate(self.flock)  # shared by all the workers, each one takes the next bird
+        failures = FailureCollector(max_samples)
+
+        async def worker():
+            for index, duck in birds:
+                try:
+                    flying = duck.fly()
+                    if inspect.isawaitable(flying):
+                        await flying
+                except AttributeError as e:
+                    say("This duck cannot fly")
+                    failures.record(index, duck, e)
+
+        await asyncio.gather(*[worker() for _ in range(max(1, limit))])
+        failures.raise_if_failed()
+
+
+
+
+# ============================
+# Columnar Flock
+# ============================
+
+# A Flock keeps every bird as a full python object in a list, each one with its own __dict__.
+# That is fine for 9 ducks, but for a million birds each one costs hundreds of bytes scattered around the heap.
+# ColumnarFlock stores the same flock as two typed arrays (columns):
+#   species - one byte per bird holding a species code (see SPECIES below)
+#   ratios  - one 8 byte float per bird holding the wing ratio
+# Ducks are only created when you ask for one (indexing or iterating), and they are thrown away after use.
+
+SPECIES = (Duck, Mallard, Penguin)  # the position in this tuple is the species code stored in the species column
+SPECIES_CODES = {species: code for code, species in enumerate(SPECIES)}
+PENGUIN = SPECIES_CODES[Penguin]
+
+DEFAULT_RATIO = 1.8  # every Duck (and so every Mallard) is built with a 1.8 wing
+
+
+def make_bird(code, ratio=DEFAULT_RATIO):
+    """ Creates a real bird object from a species code and wing ratio """
+    species = SPECIES[code]
+    if code == PENGUIN:
+        return species()                # Penguin has no wing, its fly is bound to aviate in __init__
+    bird = species.__new__(species)     # skip Duck.__init__ so we don't look up a 1.8 wing just to replace it
+    bird._wing = wing_table.get(ratio)
+    return bird
+
+
+class ColumnarFlock(object):
+
+    def __init__(self):
+        self.species = array('B')  # unsigned char column, one species code per bird
+        self.ratios = array('d')   # double column, one wing ratio per bird
+
+    def __len__(self):
+        return len(self.species)
+
+    def __getitem__(self, index):
+        return make_bird(self.species[index], self.ratios[index])
+
+    def __iter__(self):
+        for code, ratio in zip(self.species, self.ratios):
+            yield make_bird(code, ratio)
+
+    @property
+    def flock(self):
+        return self  # code written for Flock can still do "for duck in flock.flock"
+
+    def add_bird(self, code: int, ratio: float = DEFAULT_RATIO) -> None:
+        # Fast path for loaders that already know the species code, no bird object is ever created
+        if not 0 <= code < len(SPECIES):
+            raise ValueError("Unknown species code {}".format(code))
+        self.species.append(code)
+        self.ratios.append(ratio)
+
+    def add_birds(self, codes, ratios) -> None:
+        # add_bird for many birds at once, codes and ratios are sequences of the same length
+        if len(codes) != len(ratios):
+            raise ValueError("Need a ratio for every species code, got {} codes and {} ratios".format(
+                len(codes), len(ratios)))
+        # Both columns are built and checked before either one changes, so a bad value can't leave them out of step
+        codes = array('B', codes)    # raises OverflowError for codes that don't fit a byte
+        ratios = array('d', ratios)  # raises TypeError for ratios that are not numbers
+        if codes and max(codes) >= len(SPECIES):
+            raise ValueError("Unknown species code {}".format(max(codes)))
+        self.species.extend(codes)
+        self.ratios.extend(ratios)
+
+    def add_duck(self, duck: Duck) -> None:
+        if not callable(getattr(duck, 'fly', None)):  # same duck typing check as Flock.add_duck
+            raise TypeError("Cannot add duck, are you sure its not a "+str(type(duck).__name__))
+        code = SPECIES_CODES.get(type(duck))
+        if code is None:  # we can only store birds that can be rebuilt from a species code
+            raise TypeError("Cannot store a "+str(type(duck).__name__)+" in a columnar flock")
+        wing = getattr(duck, '_wing', None)
+        self.add_bird(code, wing.ratio if wing is not None else 0.0)
+
+    def migrate(self, max_samples=10):
+        failures = FailureCollector(max_samples)
+        for index, duck in enumerate(self):
+            try:
+                duck.fly()
+            except AttributeError as e:
+                say("This duck cannot fly")
+                failures.record(index, duck, e)
+        failures.raise_if_failed()
+
+    def nbytes(self):
+        # Memory used by the two columns (the actual buffers, not counting spare capacity)
+        return len(self.species) * self.species.itemsize + len(self.ratios) * self.ratios.itemsize
+
+    def batch_migrate(self):
+        # Penguins fly with aviate, so only they go through the per bird path
+        if PENGUIN in self.species:
+            custom = [index for index, code in enumerate(self.species) if code == PENGUIN]
+            winged = [index for index, code in enumerate(self.species) if code != PENGUIN]
+            result = classify_ratios(array('d', (self.ratios[index] for index in winged)), winged)
+            result.fly_each(self, custom)
+            result.failures.raise_if_failed()
+        else:
+            result = classify_ratios(self.ratios)
+        return result
+
+
+# ============================
+# Flock snapshots
+# ============================
+
+# save_snapshot writes a flock to a binary file in one write, and open_snapshot maps it back into memory.
+# The file is the two columns of a ColumnarFlock behind a small header:
+#   header   - 24 bytes: b'DUCKSNAP', format version, number of species codes, number of birds (little endian)
+#   species  - one byte per bird, the species code (padded with zeros to a multiple of 8 bytes)
+#   ratios   - one little endian 8 byte float per bird, the wing ratio (0.0 for a Penguin)
+# open_snapshot does not read the birds. It maps the file with mmap and gives you a FlockSnapshot, a read only
+# ColumnarFlock whose columns are views of the mapped file, so opening even 10 million birds only takes the one
+# quick pass that checks the species codes, and migrate/batch_migrate read the birds straight from the file as they go.
+# Only Duck, Mallard and Penguin can be saved, like in a ColumnarFlock.
+
+SNAPSHOT_MAGIC = b'DUCKSNAP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<8sIIQ')
+
+
+def snapshot_layout(birds):
+    """ Returns (offset of the species column, offset of the ratios column, file size) """
+    species_offset = SNAPSHOT_HEADER.size
+    ratios_offset = species_offset + (birds + 7) // 8 * 8  # keep the floats 8 byte aligned
+    return species_offset, ratios_offset, ratios_offset + birds * 8
+
+
+def save_snapshot(flock, filename):
+    """ Writes a Flock or ColumnarFlock to filename, returns the number of birds written """
+    if not isinstance(flock, ColumnarFlock):
+        columns = ColumnarFlock()
+        for duck in flock.flock:
+            columns.add_duck(duck)  # raises TypeError for birds that can't be stored
+        flock = columns
+    birds = len(flock)
+    species_offset, ratios_offset, size = snapshot_layout(birds)
+    ratios = array('d', flock.ratios)
+    if sys.byteorder == 'big':
+        ratios.byteswap()
+    data = b''.join([SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(SPECIES), birds),
+                     bytes(flock.species), bytes(ratios_offset - species_offset - birds), ratios.tobytes()])
+    with open(filename + '.tmp', 'wb') as snapshot_file:
+        snapshot_file.write(data)  # the whole flock in one write
+    os.replace(filename + '.tmp', filename)  # never leave a half written snapshot behind
+    return birds
+
+
+def open_snapshot(filename):
+    """ Maps a snapshot written by save_snapshot, returns a FlockSnapshot """
+    return FlockSnapshot(filename)
+
+
+class FlockSnapshot(ColumnarFlock):
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as snapshot_file:
+            header = snapshot_file.read(SNAPSHOT_HEADER.size)
+            if len(header) < SNAPSHOT_HEADER.size:
+                raise ValueError("{} is too short to be a flock snapshot".format(filename))
+            magic, version, species_count, birds = SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("{} is not a flock snapshot".format(filename))
+            if version != SNAPSHOT_VERSION:
+                raise ValueError("{} is a version {} snapshot, we can only read version {}".format(
+                    filename, version, SNAPSHOT_VERSION))
+            if species_count > len(SPECIES):
+                raise ValueError("{} was written with {} species, we only know {}".format(
+                    filename, species_count, len(SPECIES)))
+            species_offset, ratios_offset, size = snapshot_layout(birds)
+            if os.fstat(snapshot_file.fileno()).st_size < size:
+                raise ValueError("{} is truncated, expected {} bytes for {} birds".format(filename, size, birds))
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.species = self.view[species_offset:species_offset + birds]
+        if sys.byteorder == 'little':
+            self.ratios = self.view[ratios_offset:size].cast('d')
+        else:
+            self.ratios = array('d')  # needs a byte swapped copy, so not lazy
+            self.ratios.frombytes(self.view[ratios_offset:size])
+            self.ratios.byteswap()
+        # Check every species code once here, so __getitem__ and migrate can trust them
+        unknown = self.species.tobytes().translate(None, bytes(range(species_count)))
+        if unknown:
+            self.close()
+            raise ValueError("{} has a bird with species code {}, but only {} species".format(
+                filename, max(unknown), species_count))
+
+    def add_bird(self, code: int, ratio: float = DEFAULT_RATIO) -> None:
+        raise TypeError("A flock snapshot is read only, load it into a ColumnarFlock to add birds")
+
+    def add_birds(self, codes, ratios) -> None:
+        raise TypeError("A flock snapshot is read only, load it into a ColumnarFlock to add birds")
+
+    def close(self):
+        # The views have to go before the map can be closed
+        if self.map is not None:
+            for view in (self.ratios, self.species, self.view):
+                if isinstance(view, memoryview):
+                    view.release()
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ============================
+# Batch migrate
+# ============================
+
+# Flock.migrate calls duck.fly(), which calls Wing.fly(), which runs the "ratio > 1" / "== 1" / else chain.
+# That is three python calls per bird just to pick one of three outcomes.
+# batch_migrate looks at all the wing ratios at once and sorts the birds into the three outcomes:
+#   fun       - ratio > 1   "Weee, this is fun"
+#   hard_work - ratio == 1  "This is hard work, but I'm flying"
+#   walk      - ratio < 1   "I think I'll just walk"
+# It returns the counts and indexes instead of printing a line per bird.
+# Birds that have their own fly method (the Penguin whose fly is aviate) still fly the normal way,
+# and if any of them fail a MigrationFailed is raised at the end just like migrate does.
+
+
+class BatchMigration(object):
+
+    def __init__(self, fun, hard_work, walk):
+        self.fun = fun              # indexes of birds that had fun
+        self.hard_work = hard_work  # indexes of birds that found it hard work
+        self.walk = walk            # indexes of birds that decided to walk
+        self.flown = []             # indexes of birds that flew with their own fly method
+        self.failures = FailureCollector()
+
+    def counts(self):
+        return {'fun': len(self.fun), 'hard work': len(self.hard_work),
+                'walk': len(self.walk), 'flown': len(self.flown)}
+
+    def fly_each(self, birds, indexes):
+        # The per bird fallback, failures are recorded in self.failures like Flock.migrate does
+        for index in indexes:
+            try:
+                birds[index].fly()
+            except AttributeError as e:
+                say("This duck cannot fly")
+                self.failures.record(index, birds[index], e)
+            else:
+                self.flown.append(index)
+
+
+def classify_ratios(ratios, positions=None):
+    """ Sorts wing ratios into fun / hard work / walk in one pass, returns a BatchMigration """
+    # positions maps each ratio back to a bird index, by default ratio i belongs to bird i
+    if numpy is not None:
+        values = numpy.frombuffer(ratios, dtype=numpy.float64) if isinstance(ratios, array) \
+            else numpy.asarray(ratios, dtype=numpy.float64)
+        where = numpy.asarray(positions, dtype=numpy.intp) if positions is not None else numpy.arange(len(values))
+        fun, hard_work = values > 1, values == 1
+        walk = ~(fun | hard_work)  # like Wing.fly, anything that is not > 1 or == 1 walks
+        return BatchMigration(where[fun].tolist(), where[hard_work].tolist(), where[walk].tolist())
+    fun, hard_work, walk = [], [], []
+    fun_append, hard_work_append, walk_append = fun.append, hard_work.append, walk.append
+    for index, ratio in zip(positions if positions is not None else range(len(ratios)), ratios):
+        if ratio > 1:
+            fun_append(index)
+        elif ratio == 1:
+            hard_work_append(index)
+        else:
+            walk_append(index)
+    return BatchMigration(fun, hard_work, walk)
+
+
+# ============================
+# Parallel migrate
+# ============================
+
+# Flock.parallel_migrate cuts the flock into shards (one per worker), flies every shard in a process pool
+# (or a thread pool with use_processes=False) and then merges the results.
+# Each shard collects its own failures, which are merged in flock order at the end.
+# With processes the birds are pickled and sent to the workers, so they must be picklable.
+# A worker process does not use the sink it inherited from us: it keeps what its birds say in a fresh BufferedSink
+# and sends the lines back with its results, and we write them to our sink in flock order.
+
+
+def split_into_shards(birds, count):
+    """ Splits birds into at most count contiguous slices of nearly equal size, returns (slices, start indexes) """
+    size, extra = divmod(len(birds), count)
+    shards, starts = [], []
+    start = 0
+    for number in range(count):
+        end = start + size + (1 if number < extra else 0)
+        if end > start:
+            shards.append(birds[start:end])
+            starts.append(start)
+        start = end
+    return shards, starts
+
+
+def migrate_shard(birds, start=0, max_samples=10):
+    """ Flies every bird in birds, returns (number that flew, FailureCollector) """
+    flown = 0
+    failures = FailureCollector(max_samples)
+    for index, duck in enumerate(birds, start):
+        try:
+            duck.fly()
+        except AttributeError as e:
+            say("This duck cannot fly")
+            failures.record(index, duck, e)
+        else:
+            flown += 1
+    return flown, failures
 
 
+def migrate_shard_in_worker(birds, start=0, max_samples=10):
+    """ migrate_shard in a worker process, returns (number that flew, FailureCollector, lines the birds said) """
+    messages = BufferedSink()
+    set_sink(messages)  # not the copy of the parent's sink, or we would print (or lose) its buffered lines again
+    flown, failures = migrate_shard(birds, start, max_samples)
+    return flown, failures, messages.lines
 
 
 if __name__ == '__main__':
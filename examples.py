@@ -363,3 +363,17 @@ except ZeroDivisionError:
 else:             # We add else clause after all except statements, but before finally if finally exists.
     print("Else clause runs because division was performed successfully")
 
+
+
+print("="*30)
+
+# ==========================================
+# Factorials without a RecursionError
+# ==========================================
+
+# All the factorial functions above call themselves once per number, so factorial(1000) runs out of stack.
+# factorials.py calculates n! without deep recursion (it multiplies the odd numbers with binary splitting and
+# adds the factors of 2 at the end), so there is no RecursionError to catch, even for very large n.
+
+# This program never gets this far (the factorial(1000) near the top crashes it), so the demo lives in factorials.py
+# itself, run it with: python factorials.py
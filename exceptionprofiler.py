@@ -0,0 +1,150 @@
+# ======================
+# exceptionprofiler.py
+# ======================
+
+# This project is full of try/except in loops: Flock.migrate, the getint retry loop, the factorial RecursionError guard.
+# ExceptionProfiler shows what those exceptions cost. While it is running it counts, per place in the code
+# and per exception type:
+#   raised  - where the exception started (the line that raised it, or called something in C that raised it)
+#   caught  - the function whose except clause handled it
+# and for the caught ones it times the handling: from the raise until the except clause has finished
+# (unwinding the stack, building the traceback and running the handler).
+#
+#   profiler = ExceptionProfiler()
+#   with profiler:                       # as a context manager
+#       flock.migrate()
+#   getint = profiler.profile(getint)    # or as a decorator
+#   print(profiler.table())
+#
+# It uses sys.settrace, so code runs a lot slower while it is being profiled. When the profiler is disabled
+# (profiler.enabled = False) nothing is traced: the context manager does nothing and the decorator
+# only checks the flag before calling the function.
+# A trace function can't run at the recursion limit, so a RecursionError switches tracing off until the profiler
+# is entered again. Those blocks are counted in "lost" and mentioned under the table.
+
+import sys
+import time
+from collections import defaultdict
+from functools import wraps
+
+
+def site(frame, line=None):
+    code = frame.f_code
+    return "{}:{} {}".format(code.co_filename, frame.f_lineno if line is None else line, code.co_name)
+
+
+class ExceptionProfiler(object):
+
+    def __init__(self, enabled=True, clock=time.perf_counter):
+        self.enabled = enabled
+        self.clock = clock
+        self.raised = defaultdict(int)        # (site, exception type) -> count
+        self.caught = defaultdict(int)        # (site, exception type) -> count
+        self.handled_time = defaultdict(float)  # (site, exception type) -> seconds from raise to end of handler
+        self.depth = 0
+        self.lost = 0       # how many times something (a RecursionError) switched our tracing off
+        self.previous_trace = None
+        self.started = {}   # id(exception) -> time it was raised
+        self.pending = {}   # frame -> exception that just arrived in it (we don't know yet if it is caught there)
+        self.handling = {}  # frame -> (exception, key) for except clauses that are running
+
+    # ----- turning it on and off -----
+
+    def __enter__(self):
+        if self.enabled:
+            if self.depth == 0:
+                self.previous_trace = sys.gettrace()
+            if sys.gettrace() != self.trace_call:  # not yet, or a RecursionError in an outer block switched it off
+                if self.depth:
+                    self.lost += 1
+                sys.settrace(self.trace_call)
+                sys._getframe(1).f_trace = self.trace_frame  # also trace the code inside the with block
+                sys._getframe(1).f_trace_lines = False
+            self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled and self.depth:
+            self.depth -= 1
+            if self.depth == 0:
+                if sys.gettrace() != self.trace_call:
+                    self.lost += 1
+                sys.settrace(self.previous_trace)
+                sys._getframe(1).f_trace = None
+        return False
+
+    def profile(self, function):
+        """ Decorator that profiles every call of function while the profiler is enabled """
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            with self:
+                return function(*args, **kwargs)
+        return wrapper
+
+    def reset(self):
+        for table in (self.raised, self.caught, self.handled_time, self.started, self.pending, self.handling):
+            table.clear()
+        self.lost = 0
+
+    # ----- the trace functions -----
+
+    def trace_call(self, frame, event, arg):
+        frame.f_trace_lines = False  # we only need line events in frames that are dealing with an exception
+        return self.trace_frame
+
+    def trace_frame(self, frame, event, arg):
+        if event == 'exception':
+            exception_type, exception, traceback = arg
+            if traceback is not None and traceback.tb_next is None:  # it starts here, not passing through
+                self.raised[site(frame, traceback.tb_lineno), exception_type.__name__] += 1
+                self.started[id(exception)] = self.clock()
+            self.pending[frame] = exception
+            frame.f_trace_lines = True
+        elif event == 'line':
+            exception = self.pending.pop(frame, None)
+            if exception is not None:  # the exception arrived here and the frame carries on, so it was caught
+                key = (site(frame), type(exception).__name__)
+                self.caught[key] += 1
+                self.handling[frame] = (exception, key)
+            elif frame in self.handling:
+                exception, key = self.handling[frame]
+                if sys.exc_info()[1] is not exception:  # the except clause has finished
+                    self.finish_handling(frame)
+        elif event == 'return':
+            self.pending.pop(frame, None)  # the exception carries on up to the caller
+            if frame in self.handling:
+                self.finish_handling(frame)
+        return self.trace_frame
+
+    def finish_handling(self, frame):
+        exception, key = self.handling.pop(frame)
+        started = self.started.pop(id(exception), None)
+        if started is not None:
+            self.handled_time[key] += self.clock() - started
+        frame.f_trace_lines = False
+
+    # ----- results -----
+
+    def summary(self):
+        """ One dict per (kind, site, exception type), most frequent first """
+        rows = [{'kind': 'raised', 'site': where, 'exception': name, 'count': count, 'seconds': None}
+                for (where, name), count in self.raised.items()]
+        rows += [{'kind': 'caught', 'site': where, 'exception': name, 'count': count,
+                  'seconds': self.handled_time.get((where, name), 0.0)}
+                 for (where, name), count in self.caught.items()]
+        rows.sort(key=lambda row: (-row['count'], row['kind'], row['site']))
+        return rows
+
+    def table(self):
+        """ The summary as a text table """
+        lines = ["{:<7} {:>9} {:>11}  {:<20} {}".format('kind', 'count', 'seconds', 'exception', 'site')]
+        for row in self.summary():
+            seconds = '' if row['seconds'] is None else "{:.6f}".format(row['seconds'])
+            lines.append("{:<7} {:>9} {:>11}  {:<20} {}".format(
+                row['kind'], row['count'], seconds, row['exception'], row['site']))
+        if self.lost:
+            lines.append("(tracing was switched off {} times, probably by a RecursionError, "
+                         "so exceptions after that were not counted)".format(self.lost))
+        return '\n'.join(lines)
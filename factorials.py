@@ -0,0 +1,570 @@
+# ===============
+# factorials.py
+# ===============
+
+# The factorial functions in examples.py multiply n * factorial(n-1), one recursive call per number.
+# Around n = 1000 that hits the recursion limit and we get RecursionError.
+# This module calculates n! for any n without deep recursion:
+#   - n! is split into a power of two and an "odd part" (the product of odd numbers only)
+#   - the odd numbers are multiplied with binary splitting: multiply the two halves of the range and then
+#     multiply those results together, so we multiply numbers of similar size instead of one huge number by a small one.
+#     The splitting only goes log2(n) calls deep.
+#   - recently calculated results are kept in an LRU memo of at most 16 MB, and a nearby smaller result is reused
+
+import decimal
+import json
+import math
+import mmap
+import os
+import sys
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from optional import numpy  # None without numpy, then approx_log10_factorials returns an array('d')
+
+
+def odd_product(start, stop):
+    """ Product of the odd numbers start, start+2, ... below stop (start must be odd) """
+    count = (stop - start + 1) // 2
+    if count <= 16:  # small ranges are quicker with a plain loop
+        result = 1
+        for number in range(start, stop, 2):
+            result *= number
+        return result
+    middle = start + 2 * (count // 2)
+    return odd_product(start, middle) * odd_product(middle, stop)
+
+
+def range_product(start, stop):
+    """ Product of all the numbers start, start+1, ... below stop, with binary splitting """
+    if stop - start <= 16:
+        result = 1
+        for number in range(start, stop):
+            result *= number
+        return result
+    middle = (start + stop) // 2
+    return range_product(start, middle) * range_product(middle, stop)
+
+
+def odd_part(n):
+    """ The odd part of n!, i.e. n! with all its factors of 2 taken out """
+    # n! = (n//2)! * 2^(n//2) * (odd numbers up to n), and doing that again for (n//2)! and so on
+    # gives the odd part as a product of "odd numbers between n >> (i+1) and n >> i", used i+1 times.
+    inner = outer = 1
+    for shift in range(n.bit_length() - 1, -1, -1):
+        lower = ((n >> (shift + 1)) + 1) | 1  # first odd number above n >> (shift+1)
+        upper = ((n >> shift) + 1) | 1        # first odd number above n >> shift
+        inner *= odd_product(lower, upper)
+        outer *= inner
+    return outer
+
+
+def check_argument(n):
+    if not isinstance(n, int) or isinstance(n, bool):
+        raise TypeError("factorial() only accepts integers, not " + type(n).__name__)
+    if n < 0:
+        raise ValueError("factorial() not defined for negative values")
+
+
+def calculate(n):
+    """ n! without any memo """
+    check_argument(n)
+    return odd_part(n) << (n - bin(n).count('1'))  # n! has n - (number of 1 bits in n) factors of 2
+
+
+class FactorialMemo(object):
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, reuse_ratio=4):
+        self.max_bytes = max_bytes      # how many bytes of results we keep (100000! alone is about 190 KB)
+        self.reuse_ratio = reuse_ratio  # reuse m! for n! when n - m <= n / reuse_ratio
+        self.results = OrderedDict()    # n -> n!, least recently used first
+        self.nbytes = 0                 # total size of the results
+
+    def __len__(self):
+        return len(self.results)
+
+    def clear(self):
+        self.results.clear()
+        self.nbytes = 0
+
+    def factorial(self, n):
+        check_argument(n)
+        try:
+            result = self.results[n]
+        except KeyError:
+            pass
+        else:
+            self.results.move_to_end(n)
+            return result
+        below = [m for m in self.results if m < n and n - m <= n // self.reuse_ratio]
+        if below:
+            m = max(below)
+            result = self.results[m] * range_product(m + 1, n + 1)  # n! = m! * (m+1) * ... * n
+        else:
+            result = calculate(n)
+        size = (result.bit_length() + 7) // 8
+        if size <= self.max_bytes:  # a result bigger than the whole memo is not kept
+            self.results[n] = result
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, forgotten = self.results.popitem(last=False)  # forget the least recently used result
+                self.nbytes -= (forgotten.bit_length() + 7) // 8
+        return result
+
+
+memo = FactorialMemo()
+
+
+def factorial(n):
+    """ Calculates n! without recursion limits, using the module memo """
+    return memo.factorial(n)
+
+
+# ==================================
+# Many factorials at once
+# ==================================
+
+# factorial(2), factorial(3), factorial(4), factorial(900), factorial(1000) each start again from 1.
+# iter_factorials sorts the n values and keeps one running product, so every number is multiplied in only once:
+# after 900! we only need 901 * 902 * ... * 1000 to get 1000!.
+
+
+def iter_factorials(values):
+    """ Yields (n, n!) for each distinct n in values, smallest n first, from one running product """
+    values = set(values)
+    for n in values:
+        check_argument(n)
+    values = sorted(values)
+    running, done = 1, 1  # running == done!
+    for n in values:
+        if n > done:
+            running *= range_product(done + 1, n + 1)
+            done = n
+        yield n, running
+
+
+def factorial_many(values):
+    """ Returns a list with n! for every n in values, in the same order as values """
+    values = list(values)
+    results = dict(iter_factorials(values))
+    return [results[n] for n in values]
+
+
+# ==================================
+# Lazy decimal digits
+# ==================================
+
+# "Factorial 1000 = {}".format(factorial(1000)) turns the whole number into a decimal string at once.
+# For big numbers that conversion takes much longer than calculating n! (it is quadratic in CPython),
+# and since Python 3.11 str() refuses numbers over 4300 digits unless you change sys.set_int_max_str_digits.
+# LazyFactorial keeps n! as a number and only makes decimal digits when asked:
+#   digit_count(), leading_digits(k) and trailing_zeros() don't need the decimal digits at all
+#   iter_digits() / write_digits() produce the digits in chunks, using the decimal module (which multiplies
+#   huge numbers quickly) to convert by divide and conquer instead of str()
+
+# A decimal context that never rounds, so all our decimal arithmetic is exact
+EXACT = decimal.Context(prec=decimal.MAX_PREC, Emax=decimal.MAX_EMAX, Emin=decimal.MIN_EMIN,
+                        traps=[decimal.Inexact, decimal.InvalidOperation])
+
+SMALL_BITS = 3000  # numbers smaller than this are converted directly
+
+
+def to_decimal(value):
+    """ Converts a non negative int to an exact decimal.Decimal, by splitting it in halves of bits """
+    powers = {}  # bits -> Decimal(2 ** bits)
+
+    def power_of_two(bits):
+        if bits not in powers:
+            if bits <= SMALL_BITS:
+                powers[bits] = decimal.Decimal(1 << bits)
+            else:
+                half = power_of_two(bits >> 1)
+                powers[bits] = EXACT.multiply(half, half) if bits % 2 == 0 else \
+                    EXACT.multiply(EXACT.multiply(half, half), 2)
+        return powers[bits]
+
+    def convert(number, bits):
+        if bits <= SMALL_BITS:
+            return decimal.Decimal(number)
+        low_bits = bits >> 1
+        high = number >> low_bits
+        low = number - (high << low_bits)
+        # number = high * 2^low_bits + low, and Decimal multiplication of big numbers is fast
+        return EXACT.add(EXACT.multiply(convert(high, bits - low_bits), power_of_two(low_bits)),
+                         convert(low, low_bits))
+
+    return convert(value, value.bit_length())
+
+
+def decimal_chunks(number, digits, chunk_size):
+    """ Yields the digits of the integral Decimal number, zero padded to digits, in pieces of at most chunk_size """
+    if digits <= chunk_size:
+        yield format(number, 'f').zfill(digits)
+        return
+    low_digits = digits // 2
+    # dividing by a power of 10 is just moving the decimal point for a Decimal
+    high = EXACT.scaleb(number, -low_digits).to_integral_value(rounding=decimal.ROUND_FLOOR, context=EXACT)
+    low = EXACT.subtract(number, EXACT.scaleb(high, low_digits))
+    for piece in decimal_chunks(high, digits - low_digits, chunk_size):
+        yield piece
+    for piece in decimal_chunks(low, low_digits, chunk_size):
+        yield piece
+
+
+def log10_of(value, precision=40):
+    """ log10 of a positive int as a Decimal with about precision significant digits """
+    context = decimal.Context(prec=precision + len(str(value.bit_length())))
+    shift = max(0, value.bit_length() - 4 * precision)
+    top = value >> shift  # value is about top * 2^shift, and top still has plenty of digits
+    return context.add(context.log10(decimal.Decimal(top)),
+                       context.multiply(shift, context.log10(decimal.Decimal(2))))
+
+
+class LazyFactorial(object):
+
+    def __init__(self, n):
+        check_argument(n)
+        self.n = n
+        self._value = None
+
+    def __repr__(self):
+        return "LazyFactorial({})".format(self.n)
+
+    def __str__(self):
+        return ''.join(self.iter_digits())
+
+    def __int__(self):
+        return self.value
+
+    __index__ = __int__
+
+    def __eq__(self, other):
+        if isinstance(other, LazyFactorial):
+            return self.n == other.n
+        return self.value == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = factorial(self.n)
+        return self._value
+
+    def digit_count(self):
+        # the number of digits is floor(log10(n!)) + 1, n! is only a power of ten for n <= 1
+        return int(log10_of(self.value).to_integral_value(rounding=decimal.ROUND_FLOOR)) + 1
+
+    def leading_digits(self, count=10):
+        """ The first count digits of n!, as an int, worked out from log10(n!) """
+        logarithm = log10_of(self.value, count + 20)
+        exponent = logarithm.to_integral_value(rounding=decimal.ROUND_FLOOR)
+        if exponent < count:
+            return self.value // 10 ** max(0, int(exponent) + 1 - count)  # small enough to do exactly
+        context = decimal.Context(prec=count + 20)
+        mantissa = context.power(10, context.subtract(logarithm, exponent - count + 1))
+        return int(mantissa.to_integral_value(rounding=decimal.ROUND_FLOOR))
+
+    def trailing_zeros(self):
+        # each trailing zero needs a 2 and a 5, and n! always has more 2s than 5s (Legendre's formula)
+        zeros, power = 0, 5
+        while power <= self.n:
+            zeros += self.n // power
+            power *= 5
+        return zeros
+
+    def iter_digits(self, chunk_size=1 << 16):
+        """ Yields the decimal digits of n! as strings of at most chunk_size digits """
+        number = to_decimal(self.value)
+        return decimal_chunks(number, number.adjusted() + 1, chunk_size)
+
+    def write_digits(self, file, chunk_size=1 << 16):
+        """ Writes the decimal digits of n! to an open text file, one chunk at a time """
+        for piece in self.iter_digits(chunk_size):
+            file.write(piece)
+
+
+def lazy_factorial(n):
+    """ n! as a LazyFactorial, nothing is calculated until it is needed """
+    return LazyFactorial(n)
+
+
+# ==================================
+# Approximate factorials
+# ==================================
+
+# Sometimes we only want to know how big n! is, or how many times bigger 1000! is than 900!.
+# Then we don't need the exact number at all: log(n!) = lgamma(n + 1), which math.lgamma gives us
+# straight away for any n, and from log10(n!) we get n! as mantissa * 10^exponent.
+# A python float has 53 bits, so log10(n!) is right to within a few units in its last place.
+# error_bound(n) gives a safe bound on the error in log10(n!) (8 units in the last place);
+# the mantissa is then right to about ln(10) * error_bound(n) relative error,
+# e.g. 15 significant digits for 100!, 9 for (10^6)! and 4 for (10^11)!.
+
+LN10 = math.log(10)
+
+
+def approx_log10_factorial(n):
+    """ log10(n!) as a float """
+    if n < 0:
+        raise ValueError("factorial() not defined for negative values")
+    return math.lgamma(n + 1) / LN10
+
+
+def error_bound(n):
+    """ Upper bound for the absolute error of approx_log10_factorial(n) """
+    return 8 * sys.float_info.epsilon * max(1.0, approx_log10_factorial(n))
+
+
+def approx_factorial(n):
+    """ n! as (mantissa, exponent) with 1 <= mantissa < 10, so n! is about mantissa * 10**exponent """
+    logarithm = approx_log10_factorial(n)
+    exponent = math.floor(logarithm)
+    mantissa = 10 ** (logarithm - exponent)
+    if mantissa >= 10:  # rounding can push it just over
+        mantissa, exponent = mantissa / 10, exponent + 1
+    return mantissa, exponent
+
+
+def approx_log10_ratio(a, b):
+    """ log10(a! / b!) """
+    return (math.lgamma(a + 1) - math.lgamma(b + 1)) / LN10
+
+
+# Stirling's series for ln(n!), used when numpy does the work for a whole array at once.
+# With the terms up to 1/n^5 the error is below 1/(1680 n^7), less than 1e-12 for n >= 20,
+# so for n < 20 we use a table of the exact values instead.
+SMALL_LOG10 = [math.lgamma(n + 1) / LN10 for n in range(20)]
+
+
+def stirling_log10(n):
+    """ log10(n!) for a numpy float array n with every n >= 20 """
+    inverse = 1.0 / n
+    inverse2 = inverse * inverse
+    series = inverse * (1 / 12.0 - inverse2 * (1 / 360.0 - inverse2 / 1260.0))
+    return (n * numpy.log(n) - n + 0.5 * numpy.log(2 * math.pi * n) + series) / LN10
+
+
+def approx_log10_factorials(values):
+    """ log10(n!) for every n in values, as an array('d'), or as a numpy array if values is one """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        if values.size and values.min() < 0:
+            raise ValueError("factorial() not defined for negative values")
+        n = values.astype(numpy.float64)
+        small = n < len(SMALL_LOG10)
+        result = numpy.empty_like(n)
+        result[small] = numpy.asarray(SMALL_LOG10)[n[small].astype(numpy.intp)]
+        result[~small] = stirling_log10(n[~small])
+        return result
+    lgamma = math.lgamma
+    return array('d', [lgamma(n + 1) / LN10 if n >= 0 else approx_log10_factorial(n) for n in values])
+
+
+# ==================================
+# Parallel factorial
+# ==================================
+
+# For n in the millions even the binary splitting above runs on one core.
+# parallel_factorial cuts 1..n into leaves that all produce a product of about the same size
+# (numbers near n have more digits than numbers near 1, so the leaves near n are shorter),
+# multiplies the leaves in a process pool, and then multiplies the partial products together in pairs,
+# again in the pool, until one number is left.
+# The big partial products travel between processes pickled; pickle stores an int as its raw bytes,
+# so sending one costs about as much as copying it.
+
+
+def balanced_leaves(n, count):
+    """ Splits 2..n into count ranges (start, stop) whose products have about the same number of bits """
+    total = math.lgamma(n + 1)  # ln(n!), the log of the product of everything
+    bounds = [2]
+    for leaf in range(1, count):
+        target = total * leaf / count
+        low, high = bounds[-1], n + 1
+        while low < high:  # smallest k with ln((k-1)!) >= target
+            middle = (low + high) // 2
+            if math.lgamma(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        bounds.append(low)
+    bounds.append(n + 1)
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+
+
+def multiply(a, b):
+    return a * b
+
+
+def parallel_factorial(n, workers=None, leaves_per_worker=4):
+    """ Calculates n! with a process pool """
+    check_argument(n)
+    workers = workers or os.cpu_count() or 1
+    leaves = balanced_leaves(n, workers * leaves_per_worker)
+    if workers == 1 or len(leaves) <= 1:
+        return calculate(n)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        starts, stops = zip(*leaves)
+        parts = list(executor.map(range_product, starts, stops))
+        while len(parts) > 1:
+            # multiply neighbours together, a leftover odd one out waits for the next round
+            products = list(executor.map(multiply, parts[0:-1:2], parts[1::2]))
+            if len(parts) % 2:
+                products.append(parts[-1])
+            parts = products
+    return parts[0] if parts else 1
+
+
+# ==================================
+# Factorial cache on disk
+# ==================================
+
+# Every run of examples.py calculates factorial(1000) again. FactorialStore keeps results on disk:
+#   <directory>/factorials.<generation>.bin  the numbers themselves, each as raw little endian bytes (int.to_bytes)
+#   <directory>/factorials.json              the index: which data file to use, and for every n its offset and
+#                                             length in that file and when it was last used
+# The data file is memory mapped, so loading a cached n! is just int.from_bytes on the mapped bytes,
+# there is no decimal text to parse. When the numbers add up to more than max_bytes,
+# the least recently used ones are dropped and the rest are copied to a data file with the next generation number.
+# The index is switched to the new file in one os.replace, and only then is the old file deleted, so a crash at any
+# point leaves an index that matches its data file. get() also checks the entries against the size of the file,
+# and drops the ones that don't fit (all of them if the file is empty), so they are calculated again.
+
+STORE_VERSION = 2
+
+
+class FactorialStore(object):
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'factorials.json')
+        self.generation = 0  # number of the data file in use, goes up every time evict() rewrites it
+        self.entries = {}    # n -> [offset, length, last used]
+        self.clock = 0       # goes up by one every time an entry is used
+        self.map = None
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+            if index.get('version') == STORE_VERSION and os.path.exists(self.data_file(index['generation'])):
+                self.generation = index['generation']
+                self.entries = {n: [offset, length, used] for n, offset, length, used in index['entries']}
+                self.clock = max([used for _, _, used in self.entries.values()], default=0)
+        self.data_path = self.data_file(self.generation)
+        open(self.data_path, 'ab').close()  # make sure the data file exists
+        for name in os.listdir(directory):  # data files left behind by a crash in evict(), or an older version
+            if name.startswith('factorials.') and name.endswith('.bin') \
+                    and os.path.join(directory, name) != self.data_path:
+                os.remove(os.path.join(directory, name))
+
+    def data_file(self, generation):
+        return os.path.join(self.directory, 'factorials.{}.bin'.format(generation))
+
+    def __contains__(self, n):
+        return n in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def total_bytes(self):
+        return sum(length for _, length, _ in self.entries.values())
+
+    def close(self):
+        self.unmap()
+        self.save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def save_index(self):
+        index = {'version': STORE_VERSION, 'generation': self.generation,
+                 'entries': [[n, offset, length, used] for n, (offset, length, used) in sorted(self.entries.items())]}
+        with open(self.index_path + '.tmp', 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(self.index_path + '.tmp', self.index_path)  # never leave a half written index behind
+
+    def get(self, n):
+        """ Returns n! from the cache, or None if it is not there """
+        entry = self.entries.get(n)
+        if entry is None:
+            return None
+        offset, length, _ = entry
+        if self.map is None:
+            with open(self.data_path, 'rb') as data_file:
+                if os.fstat(data_file.fileno()).st_size:  # mmap can't map an empty file
+                    self.map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self.map) if self.map is not None else 0
+        if offset + length > size:  # the index does not match the data file
+            self.forget_past(size)
+            return None
+        self.clock += 1
+        entry[2] = self.clock
+        with memoryview(self.map) as view, view[offset:offset + length] as raw:
+            return int.from_bytes(raw, 'little')
+
+    def forget_past(self, size):
+        # Drops every entry that does not fit in a data file of size bytes
+        self.entries = {n: entry for n, entry in self.entries.items() if entry[0] + entry[1] <= size}
+
+    def put(self, n, value):
+        """ Stores value as n! """
+        if n in self.entries:
+            return
+        raw = value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'little')
+        self.unmap()  # the file is about to grow, the map is made again on the next get
+        with open(self.data_path, 'ab') as data_file:
+            offset = data_file.tell()
+            data_file.write(raw)
+        self.clock += 1
+        self.entries[n] = [offset, len(raw), self.clock]
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+        self.save_index()
+
+    def evict(self):
+        # drop least recently used entries until we fit, then rewrite the data file with what is left
+        by_age = sorted(self.entries, key=lambda n: self.entries[n][2])
+        total = self.total_bytes()
+        while by_age and total > self.max_bytes:
+            total -= self.entries.pop(by_age.pop(0))[1]
+        self.unmap()
+        old_path, new_path = self.data_path, self.data_file(self.generation + 1)
+        with open(old_path, 'rb') as old_file, open(new_path, 'wb') as new_file:
+            for n in sorted(self.entries, key=lambda n: self.entries[n][0]):
+                offset, length, used = self.entries[n]
+                old_file.seek(offset)
+                self.entries[n] = [new_file.tell(), length, used]
+                new_file.write(old_file.read(length))
+        self.generation += 1
+        self.data_path = new_path
+        self.save_index()  # from here on the index points at the new file
+        os.remove(old_path)
+
+    def factorial(self, n):
+        """ n! from the cache, calculating and storing it if it is not there yet """
+        value = self.get(n)
+        if value is None:
+            value = factorial(n)
+            self.put(n, value)
+        return value
+
+
+if __name__ == '__main__':
+    # The demo for the "Factorials without a RecursionError" section of examples.py
+    print("Factorial 1000 = {}".format(factorial(1000)))
+    # Python 3.11 refuses to turn an int of more than 4300 digits into a string, so we ask lazy_factorial for the digit count
+    print("Factorial 5000 has {} digits".format(lazy_factorial(5000).digit_count()))
+
+    # We can also keep the results on disk, so the next run loads factorial(1000) instead of calculating it
+    with FactorialStore("factorial_cache") as store:
+        print("Factorial 1000 from the cache = {}".format(store.factorial(1000)))
@@ -0,0 +1,85 @@
+# ===============
+# intreader.py
+# ===============
+
+# getint(prompt) in examples.py reads one number per input() call and loops on ValueError until it gets a good one.
+# That is fine for a person typing, but not when a pipe gives us millions of numbers.
+# read_ints reads the input in big chunks and yields the numbers one by one from a generator
+# (read_int_blocks gives you a list of numbers per chunk, if you would rather work on whole lists).
+# Invalid tokens don't raise an exception per token: they are passed to an on_error callback with their
+# line and column, and reading carries on.
+#   for number in read_ints():                       # numbers from stdin
+#   for number in read_ints("numbers.txt", on_error=print_invalid):
+
+import sys
+from itertools import chain
+
+WHITESPACE = ' \n\t\r\f\v'
+
+
+def print_invalid(token, line, column):
+    """ An on_error callback that complains like getint does, on stderr """
+    print("Invalid number {!r} at line {} column {}. Skipping it".format(token, line, column), file=sys.stderr)
+
+
+def line_ints(text, line_number, on_error, column_offset=0):
+    """ The numbers in one line, reporting the tokens that are not numbers (text starts column_offset characters in) """
+    numbers = []
+    column = 0
+    for token in text.split():
+        column = text.index(token, column)
+        try:
+            numbers.append(int(token))
+        except ValueError:
+            if on_error is not None:
+                on_error(token, line_number, column_offset + column + 1)
+        column += len(token)
+    return numbers
+
+
+def read_int_blocks(source=None, on_error=None, chunk_size=1 << 20):
+    """ Yields lists with the integers in source (a file name, an open text file, or stdin if None), one per chunk """
+    if isinstance(source, str):
+        with open(source) as stream:
+            for numbers in read_int_blocks(stream, on_error, chunk_size):
+                yield numbers
+        return
+    stream = sys.stdin if source is None else source
+    line_number = 1  # the line the next block starts on
+    column = 0       # and how many characters into that line it starts
+    partial = ''     # the start of a token that continues in the next chunk
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = partial + chunk
+        end = max(map(chunk.rfind, WHITESPACE))  # cut after the last whitespace, so no number is cut in two
+        if end == -1:
+            partial = chunk
+            continue
+        block, partial = chunk[:end + 1], chunk[end + 1:]
+        try:
+            # the quick way: one split and one int() per token for the whole block
+            numbers = list(map(int, block.split()))
+        except ValueError:
+            # something in this block is not a number, go through it line by line to find out where
+            numbers = []
+            for offset, text in enumerate(block.split('\n')):
+                try:
+                    numbers += [int(token) for token in text.split()]
+                except ValueError:
+                    numbers += line_ints(text, line_number + offset, on_error, column if offset == 0 else 0)
+        newlines = block.count('\n')
+        if newlines:
+            line_number += newlines
+            column = len(block) - block.rfind('\n') - 1
+        else:
+            column += len(block)
+        yield numbers
+    if partial:
+        yield line_ints(partial, line_number, on_error, column)
+
+
+def read_ints(source=None, on_error=None, chunk_size=1 << 20):
+    """ Yields every integer in source (a file name, an open text file, or stdin if None) """
+    return chain.from_iterable(read_int_blocks(source, on_error, chunk_size))
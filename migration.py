@@ -210,4 +210,33 @@ flock.migrate()
 # The other reason you may want to raise exceptions is so that you can test your exception handlers.
 # We will update the code with CHANGE_7 so that penguin1 has a flying method
 
-# See more under ducks.py
\ No newline at end of file
+# See more under ducks.py
+
+# ============================
+# Adding many ducks at once
+# ============================
+
+# Instead of calling flock.add_duck once per bird, we can give add_ducks a list (or a generator) of birds.
+# If some of them cannot fly, all the others are still added and we get one RejectedDucks exception
+# that lists every bird that was rejected, instead of stopping at the first one.
+
+# flock = ducks.Flock()
+# try:
+#     flock.add_ducks([duck1, duck2, duck3, duck4, penguin1, duck5, mallard1, duck6, duck7])
+# except ducks.RejectedDucks as e:
+#     print(e)                 # e.g. "Cannot add 1 birds that cannot fly: 1 Penguin" with the Penguin from before CHANGE_7
+#     for error in e.exceptions:
+#         print(error)
+
+# ============================
+# Loading the flock from a roster
+# ============================
+
+# Instead of writing duck1 = ducks.Duck() ... duck7 and one add_duck per bird, we can list the birds in a file
+# (roster.csv with lines like "Duck,1.8", or roster.jsonl with lines like {"species": "Mallard", "ratio": 1.8})
+# and let roster.load_roster build the flock. It reads the file a batch at a time, so the file can be huge,
+# and a bad line is reported and skipped instead of stopping the load.
+
+# import roster
+# flock = roster.load_roster("roster.csv")   # prints "Skipping line 5 of the roster: unknown species 'Goose'"
+# flock.migrate()
@@ -0,0 +1,13 @@
+# ===============
+# optional.py
+# ===============
+
+# numpy makes a few things in this project faster (batch_migrate in ducks.py, divide_all in division.py,
+# approx_log10_factorials in factorials.py), but everything also works without it.
+# This is the one place that tries to import it, the others do:
+#   from optional import numpy     # the numpy module, or None if it is not installed
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
@@ -0,0 +1,129 @@
+# ===============
+# roster.py
+# ===============
+
+# migration.py builds its flock by hand: duck1 = ducks.Duck() ... duck7, then one add_duck per bird.
+# load_roster builds a flock from a roster file instead, one bird per line:
+#   CSV    species,ratio                          e.g. Mallard,1.8   (a first line "species,ratio" is skipped)
+#   JSONL  {"species": "Mallard", "ratio": 1.8}   one JSON object per line
+# The species is Duck, Mallard or Penguin (any case). The ratio may be left out, then the bird gets the usual 1.8.
+# Penguins don't have a wing, so their ratio is ignored.
+#
+#   flock = load_roster("roster.csv")                             # a new ducks.Flock
+#   load_roster("roster.jsonl", ducks.ColumnarFlock())            # or fill a flock you already have
+#
+# The file goes through a pipeline of generators: lines -> rows -> (species code, ratio) -> batches of batch_size.
+# Each batch is handed to the flock at once (add_ducks, or add_birds for a ColumnarFlock which never builds a bird),
+# so only one batch is in memory however big the file is.
+# A malformed row (unknown species, ratio that is not a number, wrong number of fields, bad JSON) does not stop
+# the load. It is passed to the on_error callback with its line number and what is wrong with it, and skipped.
+
+import csv
+import json
+import sys
+from itertools import islice
+
+import ducks
+
+SPECIES_BY_NAME = {species.__name__.lower(): code for code, species in enumerate(ducks.SPECIES)}
+
+
+def print_bad_row(line_number, reason):
+    """ An on_error callback that complains on stderr """
+    print("Skipping line {} of the roster: {}".format(line_number, reason), file=sys.stderr)
+
+
+def csv_rows(stream, on_error):
+    """ Yields (line number, [species, ratio]) for every row of a CSV roster """
+    reader = csv.reader(stream)
+    while True:
+        try:
+            fields = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:  # the reader carries on with the next line after an error
+            on_error(reader.line_num, "invalid CSV ({})".format(e))
+            continue
+        if not fields:
+            continue  # blank line
+        if reader.line_num == 1 and fields[0].strip().lower() == 'species':
+            continue  # header
+        yield reader.line_num, fields
+
+
+def jsonl_rows(stream, on_error):
+    """ Yields (line number, [species, ratio]) for every line of a JSONL roster """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            on_error(line_number, "invalid JSON ({})".format(e))
+            continue
+        if not isinstance(record, dict):
+            on_error(line_number, "expected a JSON object, got {}".format(type(record).__name__))
+            continue
+        yield line_number, [record.get('species'), record.get('ratio')]
+
+
+def parse_rows(rows, on_error):
+    """ Turns rows into (species code, ratio), reporting the rows that don't make a bird """
+    for line_number, fields in rows:
+        if not 1 <= len(fields) <= 2:
+            on_error(line_number, "expected species and ratio, got {} fields".format(len(fields)))
+            continue
+        species = fields[0]
+        ratio = fields[1] if len(fields) == 2 else None
+        code = SPECIES_BY_NAME.get(species.strip().lower()) if isinstance(species, str) else None
+        if code is None:
+            on_error(line_number, "unknown species {!r}".format(species))
+            continue
+        if code == ducks.PENGUIN:
+            yield code, 0.0
+            continue
+        if ratio is None or ratio == '':
+            yield code, ducks.DEFAULT_RATIO
+            continue
+        try:
+            yield code, float(ratio)
+        except (TypeError, ValueError):
+            on_error(line_number, "invalid wing ratio {!r}".format(ratio))
+
+
+def batches(records, batch_size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def roster_kind(source):
+    name = source if isinstance(source, str) else getattr(source, 'name', '')
+    return 'jsonl' if str(name).lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def load_roster(source, flock=None, kind=None, batch_size=10000, on_error=print_bad_row):
+    """ Adds the birds in a roster (a file name or an open text file) to flock and returns it """
+    if flock is None:
+        flock = ducks.Flock()
+    if kind is None:
+        kind = roster_kind(source)
+    if kind not in ('csv', 'jsonl'):
+        raise ValueError("Unknown roster kind {!r}, expected 'csv' or 'jsonl'".format(kind))
+    if on_error is None:
+        on_error = lambda line_number, reason: None
+    if isinstance(source, str):
+        with open(source, newline='') as stream:
+            return load_roster(stream, flock, kind, batch_size, on_error)
+
+    rows = csv_rows(source, on_error) if kind == 'csv' else jsonl_rows(source, on_error)
+    make_bird = ducks.make_bird
+    for batch in batches(parse_rows(rows, on_error), batch_size):
+        if isinstance(flock, ducks.ColumnarFlock):
+            flock.add_birds([code for code, _ in batch], [ratio for _, ratio in batch])
+        else:
+            flock.add_ducks([make_bird(code, ratio) for code, ratio in batch], batch_size)
+    return flock